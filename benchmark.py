@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+# Measures how fast the game simulates, without a window.
+#
+# Every scenario (a map size and a number of extra monsters) runs in its own
+# process: a new game is generated, then the player wanders around and the
+# monsters take their turns, going down the stairs every few hundred turns.
+# For each scenario the turns per second, the time spent in the main
+# subsystems, how often the monsters' paths were reused (see BasicMonster)
+# and the peak memory of the process are reported, and everything
+# is written to a JSON file so runs on different commits can be compared.
+# The memory taken by one monster and one item (with all their components)
+# is reported too, next to what it takes when every slotted instance is
+# rebuilt as a plain instance with its own __dict__ (same fields, measured).
+#
+# usage: python benchmark.py [--turns 500] [--output bench_results.json]
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+	import resource  #not available on Windows
+except ImportError:
+	resource = None
+
+#(map width, map height) of each scenario; the number of rooms grows with the area
+MAP_SIZES = [(160, 80), (320, 160), (640, 320)]
+#extra monsters spawned on top of the normal ones
+MONSTER_COUNTS = [0, 50, 200]
+#go down the stairs this often
+TURNS_PER_LEVEL = 250
+
+#what gets timed: (name, owner, attribute). owner is 'main' or a class in main.
+SUBSYSTEMS = [
+	('make_map', 'main', 'make_map'),
+	('initialize_fov', 'main', 'initialize_fov'),
+	('next_level', 'main', 'next_level'),
+	('render_all', 'main', 'render_all'),
+	('autosave', 'main', 'autosave'),
+	('monster_turn', 'BasicMonster', 'take_turn'),
+	('take_damage', 'Fighter', 'take_damage'),
+	]
+
+class Timings(object):
+	#inclusive time and number of calls of each wrapped function
+	def __init__(self):
+		self.seconds = {}
+		self.calls = {}
+
+	def wrap(self, name, function):
+		def timed(*args, **kwargs):
+			start = time.time()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.seconds[name] = self.seconds.get(name, 0.0) + time.time() - start
+				self.calls[name] = self.calls.get(name, 0) + 1
+		return timed
+
+	def report(self):
+		return dict((name, {'calls': self.calls[name], 'seconds': round(self.seconds[name], 6)})
+			for name in self.seconds)
+
+def peak_memory_kb():
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		peak /= 1024  #bytes on Mac OS, kilobytes elsewhere
+	return peak
+
+def spawn_extra_monsters(main, count, rng):
+	#put count monsters from the config on random free tiles
+	names = list(main.templates.monsters)
+	placed = 0
+	while placed < count:
+		x = rng.randint(1, main.map.width - 2)
+		y = rng.randint(1, main.map.height - 2)
+		if not main.is_blocked(x, y):
+			template = main.templates.monsters[rng.choice(names)]
+			monster = main.spawn_monster(template, x, y)
+			main.objects.append(monster)
+			main.schedule_actor(monster)
+			placed += 1
+
+class Plain(object):
+	#an instance with a __dict__, for unslotted_bytes()
+	pass
+
+def unslotted_bytes(part):
+	#bytes of part as an instance with a __dict__: a Plain instance is given
+	#the same fields, one attribute at a time like __init__ would, and measured
+	if hasattr(part, '__dict__'):
+		return sys.getsizeof(part) + sys.getsizeof(part.__dict__)
+	plain = Plain()
+	for (field, value) in part.__getstate__().items():
+		setattr(plain, field, value)
+	return sys.getsizeof(plain) + sys.getsizeof(plain.__dict__)
+
+def entity_bytes(obj):
+	#(bytes, bytes with instance dicts) of an object and its components,
+	#without the values they share with other objects (names, colors...)
+	parts = [part for part in (obj, obj.fighter, obj.ai, obj.item, obj.equipment, obj.player_stats) if part is not None]
+	size = sum(sys.getsizeof(part) + sys.getsizeof(getattr(part, '__dict__', {})) for part in parts)
+	return (size, sum(unslotted_bytes(part) for part in parts))
+
+def memory_report():
+	#runs in a child process: bytes per monster and per item, with the
+	#game's classes and as they would be with instance dicts
+	import main
+	real_stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		main.init(headless=True)
+		report = {}
+		for (name, templates, spawn) in (('monster', main.templates.monsters, main.spawn_monster),
+				('item', main.templates.items, main.spawn_item)):
+			sizes = [entity_bytes(spawn(template, 0, 0)) for template in templates.values()]
+			report[name] = {
+				'bytes': sum(size for (size, with_dict) in sizes) // len(sizes),
+				'bytes_with_dicts': sum(with_dict for (size, with_dict) in sizes) // len(sizes),
+				}
+	finally:
+		sys.stdout.close()
+		sys.stdout = real_stdout
+	return report
+
+def run_scenario(scenario):
+	#runs in a child process, so memory and module state are per scenario
+	(width, height, monsters, turns, seed) = scenario
+	import main
+
+	main.MAP_WIDTH = width
+	main.MAP_HEIGHT = height
+	main.MAX_ROOMS = main.MAX_ROOMS * width * height / (160 * 80)
+	save_dir = tempfile.mkdtemp()
+	#don't overwrite the player's save
+	main.SAVE_FILE = os.path.join(save_dir, 'benchmark.sav')
+	main.LEVELS_DIR = os.path.join(save_dir, 'levels')
+	rng = random.Random(seed)
+
+	timings = Timings()
+	for (name, owner, attribute) in SUBSYSTEMS:
+		target = main if owner == 'main' else getattr(main, owner)
+		setattr(target, attribute, timings.wrap(name, getattr(target, attribute)))
+
+	#the game prints a lot of debug output, keep it out of the report
+	real_stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		main.init(headless=True)
+		main.new_game(seed=seed)  #same dungeon and fights on every run
+		spawn_extra_monsters(main, monsters, rng)
+		start = time.time()
+		for turn in range(1, turns + 1):
+			#the player wanders around (attacking whatever is in the way) and can't die
+			main.player.fighter.hp = main.player.fighter.max_hp
+			main.player_move_or_attack(*rng.choice(main.NEIGHBOURS))
+			main.take_monster_turns()
+			main.render_all()
+			if turn % TURNS_PER_LEVEL == 0:
+				main.next_level()
+				spawn_extra_monsters(main, monsters, rng)
+		seconds = time.time() - start
+	finally:
+		main.autosaver.wait()
+		shutil.rmtree(save_dir)
+		sys.stdout.close()
+		sys.stdout = real_stdout
+
+	return {
+		'map_width': width,
+		'map_height': height,
+		'extra_monsters': monsters,
+		'turns': turns,
+		'seconds': round(seconds, 6),
+		'turns_per_second': round(turns / seconds, 2) if seconds > 0 else None,
+		'subsystems': timings.report(),
+		'monster_paths': dict(main.BasicMonster.path_stats),
+		'peak_memory_kb': peak_memory_kb(),
+		}
+
+def child_process(function, args, results):
+	results.put(function(*args))
+
+def run_in_process(function, *args):
+	#not a Pool: its workers can't start the game's level generator process
+	results = multiprocessing.Queue()
+	process = multiprocessing.Process(target=child_process, args=(function, args, results))
+	process.start()
+	result = results.get()
+	process.join()
+	return result
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip().decode('ascii')
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Measure how fast the game simulates.')
+	parser.add_argument('--turns', type=int, default=500, help='turns per scenario')
+	parser.add_argument('--seed', type=int, default=1, help='seed for the scripted player')
+	parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+	args = parser.parse_args()
+
+	memory = run_in_process(memory_report)
+	for (name, sizes) in sorted(memory.items()):
+		print('%-8s %6d bytes each (%d with instance dicts)' % (name, sizes['bytes'], sizes['bytes_with_dicts']))
+
+	results = []
+	for (width, height) in MAP_SIZES:
+		for monsters in MONSTER_COUNTS:
+			#a fresh process per scenario, so its peak memory is its own
+			result = run_in_process(run_scenario, (width, height, monsters, args.turns, args.seed))
+			results.append(result)
+			print('%4dx%-4d %4d extra monsters: %8.1f turns/s, peak %s KB' % (width, height, monsters,
+				result['turns_per_second'] or 0, result['peak_memory_kb']))
+			for (name, timing) in sorted(result['subsystems'].items()):
+				print('\t%-16s %8d calls %10.3f s' % (name, timing['calls'], timing['seconds']))
+			paths = result['monster_paths']
+			print('\t%-16s %8d recomputed %6d cached' % ('monster paths', paths['recomputed'], paths['cached']))
+
+	with open(args.output, 'w') as output:
+		json.dump({
+			'commit': git_commit(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'seed': args.seed,
+			'turns': args.turns,
+			'results': results,
+			'entity_memory': memory,
+			}, output, indent=2, sort_keys=True)
+	print('results written to ' + args.output)
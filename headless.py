@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+#Headless backend for main.py.
+#
+#HeadlessBackend stands in for the libtcodpy module. Maps, paths, random
+#numbers and colors are still handled by libtcod, but there is no window:
+#console drawing calls do nothing and key presses come from a script.
+#With it, main.py can be driven as a library (new_game, make_map, monster
+#turns, next_level...) on a machine without a display, as fast as the CPU
+#allows. See main.init().
+
+import collections
+import textwrap
+import time
+
+import libtcodpy
+
+class InputExhausted(Exception):
+	#raised when the game blocks waiting for a key after the script ran out
+	pass
+
+class HeadlessBackend(object):
+	def __init__(self, keys=(), lib=libtcodpy):
+		self.lib = lib
+		self.keys = collections.deque()
+		self.closed = False  #set once the script is used up
+		self.consoles = {0: (0, 0)}  #console -> (width, height)
+		self.started = time.time()
+		self.push_keys(keys)
+
+	def __getattr__(self, name):
+		#everything that isn't drawing or input goes to the real libtcod
+		if name.startswith('console_'):
+			return self._ignore
+		return getattr(self.lib, name)
+
+	def _ignore(self, *args, **kwargs):
+		return None
+
+	#scripted input
+	def push_keys(self, keys):
+		#queue key presses. a key is a one-letter string ('g'), the name of a
+		#libtcod KEY_ constant without the prefix ('UP', 'ESCAPE', 'KP5') or a
+		#libtcodpy.Key.
+		for key in keys:
+			self.keys.append(self.make_key(key))
+		if self.keys:
+			self.closed = False
+
+	def make_key(self, key):
+		if isinstance(key, self.lib.Key):
+			return key
+		new_key = self.lib.Key()
+		new_key.pressed = True
+		if len(key) == 1:
+			new_key.vk = self.lib.KEY_CHAR
+			new_key.c = ord(key)
+		else:
+			new_key.vk = getattr(self.lib, 'KEY_' + key.upper())
+		return new_key
+
+	def next_key(self, blocking=False):
+		#returns the next scripted key, or an empty one once the script is done
+		if self.keys:
+			return self.keys.popleft()
+		self.closed = True
+		if blocking:
+			raise InputExhausted('the game waits for a key but the script is empty')
+		return self.lib.Key()
+
+	#window and input
+	def console_init_root(self, w, h, title, fullscreen=False, renderer=None):
+		self.consoles[0] = (w, h)
+
+	def console_is_window_closed(self):
+		return self.closed
+
+	def console_is_fullscreen(self):
+		return False
+
+	def console_wait_for_keypress(self, flush):
+		return self.next_key(blocking=True)
+
+	def console_check_for_keypress(self, flags=None):
+		return self.next_key()
+
+	def sys_check_for_event(self, mask, key, mouse):
+		new_key = self.next_key()
+		for (field, field_type) in self.lib.Key._fields_:
+			setattr(key, field, getattr(new_key, field))
+		return 0
+
+	def sys_wait_for_event(self, mask, key, mouse, flush):
+		return self.sys_check_for_event(mask, key, mouse)
+
+	def sys_set_fps(self, fps):
+		pass  #never wait between frames
+
+	def sys_get_fps(self):
+		return 0
+
+	def sys_elapsed_milli(self):
+		return int((time.time() - self.started) * 1000)
+
+	def sys_elapsed_seconds(self):
+		return time.time() - self.started
+
+	#consoles: only their sizes are remembered
+	def console_new(self, w, h):
+		con = len(self.consoles)
+		self.consoles[con] = (w, h)
+		return con
+
+	def console_get_width(self, con):
+		return self.consoles[con][0]
+
+	def console_get_height(self, con):
+		return self.consoles[con][1]
+
+	def console_get_height_rect(self, con, x, y, w, h, fmt):
+		return min(h, len(textwrap.wrap(fmt, w)))
+
+	def console_get_char_background(self, con, x, y):
+		return self.lib.black
+
+	def console_get_char_foreground(self, con, x, y):
+		return self.lib.white
+
+	def console_get_char(self, con, x, y):
+		return ord(' ')
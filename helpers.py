@@ -3,9 +3,112 @@ import json
 import ConfigParser
 import textwrap
 import CONSTANTS
-def random_choice_index(chances):  #choose one option from list of chances, returning its index
-	#the dice will land on some number between 1 and the sum of the chances
-	dice = libtcod.random_get_int(0, 1, sum(chances))
+
+#largest number of outcomes drawn with one libtcod call. libtcod maps its
+#32 bit numbers onto a range with a modulo, keep the range small enough for
+#the bias to stay negligible.
+BULK_RANGE = 1 << 20
+
+def roll_ranges(ranges, rnd=0):
+	#returns one random number for each (min, max) in ranges, like
+	#libtcod.random_get_int(rnd, min, max) would. several ranges are rolled
+	#with a single libtcod call: one number is drawn from the product of the
+	#range sizes and split into digits, one per range.
+	results = []
+	i = 0
+	while i < len(ranges):
+		#take as many ranges as fit into one draw (always at least one)
+		sizes = [ranges[i][1] - ranges[i][0] + 1]
+		outcomes = sizes[0]
+		while i + len(sizes) < len(ranges):
+			(low, high) = ranges[i + len(sizes)]
+			if outcomes * (high - low + 1) > BULK_RANGE:
+				break
+			sizes.append(high - low + 1)
+			outcomes *= high - low + 1
+		number = libtcod.random_get_int(rnd, 0, outcomes - 1)
+		for size in sizes:
+			results.append(ranges[i][0] + number % size)
+			number //= size
+			i += 1
+	return results
+
+class Dice(object):
+	#a dice expression like '2d6' or '3d4+2', parsed once and rolled many times
+	def __init__(self, expression):
+		self.expression = expression
+		text = expression.lower().replace(' ', '')
+		bonus = 0
+		for sign in ('+', '-'):
+			if sign in text:
+				(text, bonus) = text.split(sign, 1)
+				bonus = int(bonus) if sign == '+' else -int(bonus)
+		d_index = text.index('d')
+		self.count = int(text[0:d_index] or 1)
+		self.sides = int(text[d_index + 1:])
+		self.bonus = bonus
+		self.ranges = ((1, self.sides),) * self.count
+
+	def roll(self, rnd=0):
+		return sum(roll_ranges(self.ranges, rnd)) + self.bonus
+
+	def __repr__(self):
+		return 'Dice(' + repr(self.expression) + ')'
+
+class WeightedChoice(object):
+	#picks keys of a {key: chance} dictionary with probability proportional
+	#to their chance, using the alias method: the table is built once, then
+	#every pick is one random number and one lookup, however many keys
+	#there are.
+	def __init__(self, chances_dict):
+		self.keys = list(chances_dict.keys())
+		weights = [int(chance) for chance in chances_dict.values()]
+		self.total = sum(weights)
+		n = len(weights)
+		#each key gets a column of height total. a column holds the key itself
+		#up to threshold and its alias above that.
+		self.threshold = [self.total] * n
+		self.alias = range(n)
+		if self.total <= 0:
+			return
+		scaled = [w * n for w in weights]
+		small = [i for i in range(n) if scaled[i] < self.total]
+		large = [i for i in range(n) if scaled[i] >= self.total]
+		while small and large:
+			s = small.pop()
+			l = large.pop()
+			self.threshold[s] = scaled[s]
+			self.alias[s] = l
+			scaled[l] += scaled[s] - self.total
+			if scaled[l] < self.total:
+				small.append(l)
+			else:
+				large.append(l)
+
+	def __len__(self):
+		return len(self.keys)
+
+	def choose_index(self, rnd=0):
+		if self.total <= 0:
+			raise ValueError('nothing to choose from, every chance is 0')
+		n = len(self.keys)
+		if n * self.total <= BULK_RANGE:
+			number = libtcod.random_get_int(rnd, 0, n * self.total - 1)
+			(column, height) = divmod(number, self.total)
+		else:
+			(column, height) = roll_ranges(((0, n - 1), (0, self.total - 1)), rnd)
+		if height < self.threshold[column]:
+			return column
+		return self.alias[column]
+
+	def choose(self, rnd=0):
+		#returns a random key
+		return self.keys[self.choose_index(rnd)]
+
+def random_choice_index(chances, rnd=0):  #choose one option from list of chances, returning its index
+	#the dice will land on some number between 1 and the sum of the chances.
+	#rnd is the libtcod generator to roll with (0 is the default one).
+	dice = libtcod.random_get_int(rnd, 1, sum(chances))
 
 	#go through all chances, keeping the sum so far
 	running_sum = 0
@@ -18,12 +121,13 @@ def random_choice_index(chances):  #choose one option from list of chances, retu
 			return choice
 		choice += 1
 
-def random_choice(chances_dict):
-	#choose one option from dictionary of chances, returning its key
+def random_choice(chances_dict, rnd=0):
+	#choose one option from dictionary of chances, returning its key. to pick
+	#from the same chances many times, a WeightedChoice is faster.
 	chances = chances_dict.values()
 	strings = chances_dict.keys()
 
-	return strings[random_choice_index(chances)]
+	return strings[random_choice_index(chances, rnd)]
 
 def get_config(config, target, false_return=None):
 	if config.has_key(str(target)):
@@ -32,7 +136,7 @@ def get_config(config, target, false_return=None):
 	else:
 		return false_return
 
-def roll_dice(die):
+def roll_dice(die, rnd=0):
 	'''
 	this function simulates rolling hit dies and returns the resulting 
 	nbr of hitpoints. Hit dies are specified in the format xdy where
@@ -40,17 +144,14 @@ def roll_dice(die):
 	thrown. For example 2d6 means rolling 2 six sided dices.
 	Arguments
 		hitdie - a string in hitdie format
+		rnd - the libtcod generator to roll with (0 is the default one)
 	Returns
 		integer number of a result
 	'''
-	#interpret the hitdie string
-	d_index = die.lower().index('d')
-	nbr_of_rolls = int(die[0:d_index])
-	dice_size = int(die[d_index + 1:])
-	#roll the dice
-	role_count = 0
-	result = 0
-	while role_count <= nbr_of_rolls:
-		role_count += 1
-		result += libtcod.random_get_int(0, 1, dice_size)
-	return result
+	#interpret the hitdie string (once per string), then roll the dice
+	dice = _parsed_dice.get(die)
+	if dice is None:
+		dice = _parsed_dice[die] = Dice(die)
+	return dice.roll(rnd)
+
+_parsed_dice = {}  #hitdie string -> Dice, for roll_dice()
@@ -0,0 +1,17 @@
+#!/usr/bin/python
+
+#The player's inventory.
+#
+#Inventory is a KeyedList of the items by name: the menus keep their order,
+#and finding the stack an item goes on doesn't scan the list.
+
+from keyed_list import KeyedList
+
+class Inventory(KeyedList):
+	def key(self, obj):
+		return obj.name
+
+	def find(self, name):
+		#returns the first object called name, or None
+		same_name = self.group(name)
+		return same_name[0] if same_name else None
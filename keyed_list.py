@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+#A list that also groups its objects by a key.
+#
+#KeyedList behaves like a plain list (iteration, append, insert, remove,
+#index, len, [i]), so code that used a list keeps its order, and also keeps a
+#dict of the objects under each key, so finding the objects with a given key
+#doesn't scan the list. Subclasses say what the key is by defining
+#key(obj), see ObjectIndex (the tile of an object) and Inventory (the name of
+#an item).
+
+class KeyedList(object):
+	def __init__(self, objects=()):
+		self.ordered = []  #list order
+		self.groups = {}  #key -> objects with that key, in list order
+		for obj in objects:
+			self.append(obj)
+
+	def _add_to_group(self, obj, position=None):
+		#position in the group, at the end by default
+		group = self.groups.setdefault(self.key(obj), [])
+		if position is None:
+			group.append(obj)
+		else:
+			group.insert(position, obj)
+
+	def _remove_from_group(self, obj, key):
+		#returns False if obj was not grouped under key
+		group = self.groups.get(key)
+		if group is None or obj not in group:
+			return False
+		group.remove(obj)
+		if not group:
+			del self.groups[key]
+		return True
+
+	#list-like interface
+	def append(self, obj):
+		self.ordered.append(obj)
+		self._add_to_group(obj)
+
+	def insert(self, i, obj):
+		#the group keeps list order: obj goes after the members of its group
+		#that are before position i in the list
+		group = self.groups.get(self.key(obj), ())
+		if i == 0 or not group:
+			position = 0
+		else:
+			before = set(id(other) for other in self.ordered[:i])
+			position = sum(1 for other in group if id(other) in before)
+		self.ordered.insert(i, obj)
+		self._add_to_group(obj, position)
+
+	def remove(self, obj):
+		self.ordered.remove(obj)
+		self._remove_from_group(obj, self.key(obj))
+
+	def index(self, obj):
+		return self.ordered.index(obj)
+
+	def __len__(self):
+		return len(self.ordered)
+
+	def __iter__(self):
+		return iter(self.ordered)
+
+	def __getitem__(self, i):
+		return self.ordered[i]
+
+	def __contains__(self, obj):
+		return obj in self.groups.get(self.key(obj), ())
+
+	def group(self, key):
+		#returns the objects with that key. the sequence belongs to the list,
+		#so copy it before changing the list while looping over it.
+		return self.groups.get(key, ())
+
+	def __getstate__(self):
+		#saved as the list, the groups are made again when loading
+		return {'ordered': self.ordered}
+
+	def __setstate__(self, state):
+		#older saves have their own dict of groups too, it is rebuilt
+		self.ordered = []
+		self.groups = {}
+		for obj in state['ordered']:
+			self.append(obj)
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+#Levels the player has left, so they can be visited again.
+#
+#LevelStore keeps the most recently visited levels in memory and spills the
+#older ones to files in its directory (in the save file format, see
+#savefile.py), so memory use doesn't grow with the depth reached. A level is
+#whatever the game puts in it, usually a dict with the map and the objects.
+#
+#The files are named after the game, so a new game never touches the files
+#of the game in the save file until it replaces that save, see
+#remove_stale_files().
+
+import os
+from collections import OrderedDict
+
+import savefile
+
+class LevelStore(object):
+	def __init__(self, directory, capacity=2, game=None):
+		self.directory = directory
+		self.capacity = capacity  #levels kept in memory
+		self.game = game  #id of the game, in the file names (None in older saves)
+		self.levels = OrderedDict()  #depth -> level, least recently used first
+		self.on_disk = set()  #depths that have a file
+
+	def __contains__(self, depth):
+		return depth in self.levels or depth in self.on_disk
+
+	def filename(self, depth):
+		if self.game is None:  #older saves
+			return os.path.join(self.directory, 'level-' + str(depth) + '.sav')
+		return os.path.join(self.directory, 'level-' + str(self.game) + '-' + str(depth) + '.sav')
+
+	def put(self, depth, level, namespace):
+		#keep a level the player leaves. namespace is passed on to savefile
+		#when older levels have to go to disk.
+		self.levels.pop(depth, None)
+		self.levels[depth] = level
+		while len(self.levels) > self.capacity:
+			(old_depth, old_level) = self.levels.popitem(last=False)
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			savefile.write(self.filename(old_depth), old_level, namespace)
+			self.on_disk.add(old_depth)
+
+	def get(self, depth, namespace):
+		#returns the level at depth and forgets it (put it back when the player
+		#leaves it again), or None if it was never stored or its file is gone
+		if depth in self.levels:
+			return self.levels.pop(depth)
+		if depth in self.on_disk:
+			self.on_disk.discard(depth)
+			filename = self.filename(depth)
+			if os.path.exists(filename):
+				level = savefile.read(filename, namespace)
+				os.remove(filename)
+				return level
+		return None
+
+	def remove_stale_files(self):
+		#delete the level files in the directory that aren't this store's:
+		#those of a game that was replaced. only call it once this store's
+		#game has been saved over the old one.
+		if not os.path.isdir(self.directory):
+			return
+		own = set(os.path.basename(self.filename(depth)) for depth in self.on_disk)
+		for name in os.listdir(self.directory):
+			if name.startswith('level-') and name.endswith('.sav') and name not in own:
+				os.remove(os.path.join(self.directory, name))
+
+	def __getstate__(self):
+		#saved with the game; the levels on disk stay in their files
+		return {'directory': self.directory, 'capacity': self.capacity, 'game': self.game,
+			'levels': list(self.levels.items()), 'on_disk': sorted(self.on_disk)}
+
+	def __setstate__(self, state):
+		self.directory = state['directory']
+		self.capacity = state['capacity']
+		self.game = state.get('game')
+		self.levels = OrderedDict(state['levels'])
+		self.on_disk = set(state['on_disk'])
@@ -6,13 +6,35 @@
 import libtcodpy as libtcod
 import CONSTANTS
 import math
-import textwrap
+import copy
 import shelve
+import cPickle
+import os
+import sys
 import json
+import multiprocessing
 import ConfigParser
 
+try:  #import NumPy if available
+	import numpy
+	numpy_available = True
+except ImportError:
+	numpy_available = False
+
+from cStringIO import StringIO
 from helpers import *
 from spells import *
+from tile_grid import TileGrid
+from object_index import ObjectIndex
+from inventory import Inventory
+from templates import compile_templates
+from headless import HeadlessBackend
+from scheduler import TurnScheduler, NORMAL_SPEED, TURN_LENGTH, turn_length
+import savefile
+from level_store import LevelStore
+from message_log import MessageLog
+from rng import RandomStreams, new_seed, COMBAT, AI
+from profiler import FrameProfiler
  
  #actual size of the window
 SCREEN_WIDTH = 160
@@ -57,6 +79,9 @@ CONFUSE_NUM_TURNS = 10
 FIREBALL_RADIUS = 3
 FIREBALL_DAMAGE = 25
  
+#turns between two points of healing (and of energy for the player), see regenerate()
+REGEN_TURNS = 20
+
 #experience and level-ups
 LEVEL_UP_BASE = 200
 LEVEL_UP_FACTOR = 150
@@ -68,6 +93,18 @@ TORCH_RADIUS = 8
  
 LIMIT_FPS = 20  #20 frames-per-second maximum
 
+SAVE_FILE = 'savegame.sav'  #see savefile.py. older games were saved in the 'savegame' shelve
+AUTOSAVE_TURNS = 100  #turns between autosaves (there is one on every new level too)
+LEVELS_DIR = SAVE_FILE + '.levels'  #where levels left long ago are kept
+LEVEL_CACHE_SIZE = 2  #levels left recently, that are kept in memory
+PROFILE_FILE = 'profile.txt'  #frame time histograms, written on exit when profiling (see profiler.py)
+PROFILE_WIDTH = 60  #width of the frame time overlay, at the right of the log's top line
+
+#monsters further than this from the player sleep, and don't take turns
+ACTIVE_RADIUS = 40
+#how often (in game time) sleeping monsters are checked for waking up
+WAKE_CHECK_INTERVAL = 500
+
  
  
 color_dark_wall = libtcod.Color(28, 28, 28)
@@ -75,9 +112,42 @@ color_dark_ground = libtcod.Color(88, 88, 88)
 color_light_wall = libtcod.Color(97, 56, 11)
 color_light_ground = libtcod.Color(200, 180, 50)
 
-class Tile:
-	#a tile of the map and its properties
-	def __init__(self, blocked, block_sight = None):
+def slot_names(cls):
+	#the __slots__ of cls and of its bases, looked up once per class
+	names = _slot_names.get(cls)
+	if names is None:
+		names = _slot_names[cls] = tuple(name for base in cls.__mro__ for name in base.__dict__.get('__slots__', ()))
+	return names
+
+_slot_names = {}  #class -> its slot names, for slot_names()
+
+class Slotted(object):
+	#base of the classes there are many of (objects and their components).
+	#their fields are __slots__, so instances have no __dict__ of their own.
+	#they are saved as a dict of the fields that are set; DEFAULTS fills in
+	#the fields that older save games don't have.
+	__slots__ = ()
+	DEFAULTS = {}
+
+	def __getstate__(self):
+		state = {}
+		for name in slot_names(type(self)):
+			if hasattr(self, name):
+				state[name] = getattr(self, name)
+		return state
+
+	def __setstate__(self, state):
+		for (name, value) in self.DEFAULTS.items():
+			setattr(self, name, value)
+		for (name, value) in state.items():
+			setattr(self, name, value)
+
+class Tile(Slotted):
+	#a tile of the map and its properties. the map itself is now a TileGrid;
+	#this class is kept so that old save games can still be unpickled.
+	__slots__ = ('blocked', 'explored', 'block_sight')
+
+	def __init__(self, blocked=False, block_sight = None):
 		self.blocked = blocked
 
 		#all tiles start unexplored
@@ -87,8 +157,10 @@ class Tile:
 		if block_sight is None: block_sight = blocked
 		self.block_sight = block_sight
 
-class Rect:
+class Rect(Slotted):
 	#a rectangle on the map. used to characterize a room.
+	__slots__ = ('x1', 'y1', 'x2', 'y2')
+
 	def __init__(self, x, y, w, h):
 		self.x1 = x
 		self.y1 = y
@@ -105,10 +177,15 @@ class Rect:
 		return (self.x1 <= other.x2 and self.x2 >= other.x1 and
 				self.y1 <= other.y2 and self.y2 >= other.y1)
 
-class Object:
+class Object(Slotted):
 	#this is a generic object: the player, a monster, an item, the stairs...
 	#it's always represented by a character on screen.
+	__slots__ = ('x', 'y', 'char', 'name', 'color', 'blocks', 'always_visible', 'fighter', 'ai', 'item', 'equipment',
+		'player_stats', 'player_skills', 'equipment_bonuses', 'level')
+	DEFAULTS = {'equipment_bonuses': None}
+
 	def __init__(self, x, y, char, name, color, blocks=False, always_visible=False, fighter=None, ai=None, player_stats=None, player_skills=None, item=None, equipment=None):
+		self.equipment_bonuses = None  #cached sums of the equipped items' bonuses, see get_equipment_bonuses()
 		self.x = x
 		self.y = y
 		self.char = char
@@ -152,8 +229,7 @@ class Object:
 	def move(self, dx, dy):
 		#move by the given amount, if the destination is not blocked
 		if not is_blocked(self.x + dx, self.y + dy):
-			self.x += dx
-			self.y += dy
+			objects.move(self, self.x + dx, self.y + dy)
 
 	def move_towards(self, target_x, target_y):
 		#vector from this object to the target, and distance
@@ -183,27 +259,18 @@ class Object:
 		objects.remove(self)
 		objects.insert(0, self)
 
-	def draw(self):
-		#only show if it's visible to the player
-		if libtcod.map_is_in_fov(fov_map, self.x, self.y) or (self.always_visible and map[self.x][self.y].explored):
-			(x, y) = to_camera_coordinates(self.x, self.y)
+	def is_seen(self):
+		#true if the player can see the object (or remembers it, see always_visible)
+		return is_visible(self.x, self.y) or (self.always_visible and map.get('explored', self.x, self.y))
 
-			if x is not None:
-				#set the color and then draw the character that represents this object at its position
-				libtcod.console_set_default_foreground(con, self.color)
-				libtcod.console_put_char(con, x, y, self.char, libtcod.BKGND_NONE)
 
-	def clear(self):
-		#erase the character that represents this object
-		(x, y) = to_camera_coordinates(self.x, self.y)
-		if x is not None:
-			libtcod.console_put_char(con, x, y, ' ', libtcod.BKGND_NONE)
-
-
-class Fighter:
-	tick_total = 0
+class Fighter(Slotted):
 	#combat-related properties and methods (monster, player, NPC).
-	def __init__(self, hp, defense, power, xp, death_function=None, species='Humanoid', evade = 10, block = 0, accuracy = 12):
+	__slots__ = ('owner', 'base_max_hp', 'hp', 'base_defense', 'base_evade', 'base_block', 'base_power', 'base_accuracy',
+		'xp', 'death_function', 'species', 'speed')
+	DEFAULTS = {'speed': NORMAL_SPEED}
+
+	def __init__(self, hp, defense, power, xp, death_function=None, species='Humanoid', evade = 10, block = 0, accuracy = 12, speed = NORMAL_SPEED):
 		self.base_max_hp = hp
 		self.hp = hp
 		self.base_defense = defense
@@ -214,10 +281,11 @@ class Fighter:
 		self.xp = xp
 		self.death_function = death_function
 		self.species = species
+		self.speed = speed  #higher is faster, see scheduler.py
 
 	@property
 	def power(self):  #return actual power, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.power_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['power_bonus']
 		return self.base_power + bonus
 
 	@property
@@ -226,12 +294,12 @@ class Fighter:
 		if self.owner.is_player():
 			stats = self.owner.player_stats
 			stat_bonus = (stats.strength + stats.agility) / 2
-		bonus = sum(equipment.accuracy_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['accuracy_bonus']
 		return self.base_accuracy + stat_bonus + bonus
 
 	@property
 	def defense(self):  #return actual defense, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.defense_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['defense_bonus']
 		return self.base_defense + bonus
 	
 	@property
@@ -239,17 +307,18 @@ class Fighter:
 		skill_bonus = 0 
 		if self.owner.is_player(): #Monsters don't use skills, so we need to check if it's a player.
 			skill_bonus = self.owner.player_skills.skills['Dodge']
-		bonus = sum(equipment.evade_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['evade_bonus']
 		return self.base_evade + skill_bonus + bonus
 
 	@property
 	def block(self):  #Return actual block stat, by summing up bonuses from equipment and skills.
-		if get_equipped_in_slot('left hand') == None: #No shield means no blocking.
+		bonuses = get_equipment_bonuses(self.owner)
+		if 'left hand' not in bonuses['slots']: #No shield means no blocking.
 			return 0
 		skill_bonus = 0
 		if self.owner.is_player(): #Monsters don't use skills, so we need to check if it's a player.
 			skill_bonus = self.owner.player_skills.skills['Shields']
-		bonus = sum(equipment.block_bonus for equipment in get_all_equipped(self.owner))
+		bonus = bonuses['block_bonus']
 		return self.base_block + skill_bonus + bonus
 
 	@property
@@ -257,7 +326,7 @@ class Fighter:
 		level_bonus = 0
 		if self.owner.is_player():
 			level_bonus = int(11.0 * (player.level / 2.0))
-		bonus = sum(equipment.max_hp_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['max_hp_bonus']
 		return self.base_max_hp + level_bonus + bonus
 
 	def attack(self, target):
@@ -304,7 +373,7 @@ class Fighter:
 	
 	def armor_roll(self, damage):
 		#a slightly less simple formula for attack damage
-		armor_reduction = libtcod.random_get_int(0, 0, self.defense) #Roll a number, up to our combined armor value.
+		armor_reduction = libtcod.random_get_int(streams.get(COMBAT), 0, self.defense) #Roll a number, up to our combined armor value.
 		damage -= armor_reduction #Reduce damage by how high we rolled.
 		if damage <= 0: #If we completely negated the attack, let everyone know.
 			message(self.owner.name.title() + "'s defenses compltely absorb the attack.", libtcod.grey, False)
@@ -319,9 +388,7 @@ class Fighter:
 			if evade <= 0:
 				return False #Don't bother rolling if we can never dodge
 			
-			to_hit_dice = libtcod.random_get_int(0, 0, to_hit)
-			evade_dice_1 = libtcod.random_get_int(0, 0, evade)
-			evade_dice_2 = libtcod.random_get_int(0, 0, evade)
+			(to_hit_dice, evade_dice_1, evade_dice_2) = roll_ranges(((0, to_hit), (0, evade), (0, evade)), streams.get(COMBAT))
 			evade_dice = (evade_dice_1 + evade_dice_2) / 2
 			if to_hit_dice >= evade_dice:
 				return False #We failed to dodge.
@@ -339,9 +406,7 @@ class Fighter:
 		if shields <= 0:
 			return False #Don't bother rolling if we can never block.
 		
-		to_hit_dice = libtcod.random_get_int(0, 0, to_hit)
-		block_dice_1 = libtcod.random_get_int(0, 0, shields)
-		block_dice_2 = libtcod.random_get_int(0, 0, shields)
+		(to_hit_dice, block_dice_1, block_dice_2) = roll_ranges(((0, to_hit), (0, shields), (0, shields)), streams.get(COMBAT))
 		block_dice = (block_dice_1 + block_dice_2) / 2
 		if to_hit_dice >= block_dice:
 			return False #We failed to block.
@@ -359,46 +424,50 @@ class Fighter:
 			self.hp = self.max_hp
 	
 	def adjust_max_hp(self, amount):
-		self.max_hp = self.max_hp + amount
+		self.base_max_hp = self.base_max_hp + amount
 
 	def adjust_hp(self, amount):
 		self.hp = self.hp + amount
 
 	def adjust_all_hp(self, amount):
-		self.max_hp = self.max_hp + amount
+		self.base_max_hp = self.base_max_hp + amount
 		self.hp = self.hp + amount
-	
-	def tick(self):
-		if self.tick_total is None:
-			self.tick_total = 0
-		self.tick_total += 1
-		self.autoheal()
-		if self.owner.player_stats:
-			self.owner.player_stats.autorecharge()
-	
-	def autoheal(self):
-		if self.tick_total % (20) == 0:
-			self.heal(1)
-		
 
-def do_after(target, delay):
-	if target is None or delay is None:
-		return 0
-	start_tick = target.fighter.tick_total
-	end_tick = target.fighter.tick_total + delay
-	
-	while not libtcod.console_is_window_closed():
-		if target.fighter.tick_total >= end_tick:
-			break
-	
-	
-	'''
-	while target.fighter.tick_total is not end_tick:
-		pass
-	'''
-	return True
+	def __setstate__(self, state):
+		#older save games may have max_hp itself, set over the property (it
+		#includes the bonuses of the time, so the player keeps a little extra)
+		if 'max_hp' in state:
+			state['base_max_hp'] = state.pop('max_hp')
+		state.pop('tick_total', None)  #the game time is the scheduler's now
+		Slotted.__setstate__(self, state)
+
+def do_after(delay, function, *args):
+	#call function(*args) after delay turns of game time. function must be a
+	#module-level function so the event can be saved. returns the event, which
+	#can be given to scheduler.cancel().
+	return scheduler.call_later(delay * TURN_LENGTH, function, *args)
+
+def regenerate():
+	#timed event, every REGEN_TURNS: the player and the monsters of the level
+	#heal a little and the player's energy recharges
+	for actor in scheduler.actors():
+		if actor.fighter and actor is not player:
+			actor.fighter.heal(1)
+	player.fighter.heal(1)
+	player.player_stats.recharge(1)
+	do_after(REGEN_TURNS, regenerate)
+
+def start_regeneration():
+	#schedule the first regenerate(), unless it's already pending (saved games)
+	for event in scheduler.events:
+		if event[2] is regenerate:
+			return
+	do_after(REGEN_TURNS, regenerate)
+
+class PlayerStats(Slotted): #Anything we want to track on the player specifically goes here
+	__slots__ = ('owner', 'base_strength', 'base_agility', 'base_intelligence', 'base_max_oxygen', 'oxygen',
+		'base_max_energy', 'energy', 'race', 'title')
 
-class PlayerStats: #Anything we want to track on the player specifically goes here
 	def __init__(self, strength, agility, intelligence, oxygen, energy=0):
 		self.base_strength = strength
 		self.base_agility = agility
@@ -410,27 +479,27 @@ class PlayerStats: #Anything we want to track on the player specifically goes he
 
 	@property
 	def strength(self):  #return actual strength, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.strength_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['strength_bonus']
 		return self.base_strength + bonus
 
 	@property
 	def agility(self):  #return actual agility, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.agility_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['agility_bonus']
 		return self.base_agility + bonus
 
 	@property
 	def intelligence(self):  #return actual intelligence, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.intelligence_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['intelligence_bonus']
 		return self.base_intelligence + bonus
 
 	@property
 	def max_oxygen(self):  #return actual max_oxygen, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.oxygen_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['oxygen_bonus']
 		return self.base_max_oxygen + bonus
 	
 	@property
 	def max_energy(self):  #return actual max_energy, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.energy_bonus for equipment in get_all_equipped(self.owner))
+		bonus = get_equipment_bonuses(self.owner)['energy_bonus']
 		return self.base_max_energy + bonus
 
 	def breathe(self, amount):
@@ -450,13 +519,13 @@ class PlayerStats: #Anything we want to track on the player specifically goes he
 			self.oxygen = self.max_oxygen
 	
 	def adjust_max_oxygen(self, amount):
-		self.max_oxygen = self.max_oxygen + amount
+		self.base_max_oxygen = self.base_max_oxygen + amount
 
 	def adjust_oxygen(self, amount):
 		self.oxygen = self.oxygen + amount
 
 	def adjust_all_oxygen(self, amount):
-		self.max_oxygen = self.max_oxygen + amount
+		self.base_max_oxygen = self.base_max_oxygen + amount
 		self.oxygen = self.oxygen + amount
 	
 	def drain_energy(self, amount):
@@ -470,16 +539,12 @@ class PlayerStats: #Anything we want to track on the player specifically goes he
 			self.energy = self.max_energy
 
 	def adjust_max_energy(self, amount):
-		self.max_energy = self.max_energy + amount
+		self.base_max_energy = self.base_max_energy + amount
 
 	def adjust_all_energy(self, amount):
-		self.max_energy = self.max_energy + amount
+		self.base_max_energy = self.base_max_energy + amount
 		self.energy = self.energy + amount
 
-	def autorecharge(self):
-		if self.owner.fighter.tick_total % (20) == 0:
-			self.recharge(1)
-
 	def change_race(self, race):
 		self.race = race
 	
@@ -487,13 +552,21 @@ class PlayerStats: #Anything we want to track on the player specifically goes he
 		self.title = title
 	
 	def adjust_strength(self, amount):
-		self.strength = self.strength + amount
+		self.base_strength = self.base_strength + amount
 
 	def adjust_agility(self, amount):
-		self.agility = self.agility + amount
+		self.base_agility = self.base_agility + amount
 
 	def adjust_intelligence(self, amount):
-		self.intelligence = self.intelligence + amount
+		self.base_intelligence = self.base_intelligence + amount
+
+	def __setstate__(self, state):
+		#older save games may have stats set over their properties (bonuses
+		#included, see Fighter.__setstate__)
+		for name in ('strength', 'agility', 'intelligence', 'max_oxygen', 'max_energy'):
+			if name in state:
+				state['base_' + name] = state.pop(name)
+		Slotted.__setstate__(self, state)
 
 class PlayerSkills():
 	skills = {}
@@ -533,84 +606,236 @@ class PlayerSkills():
 
 
 
+#the eight cells around a monster, orthogonal ones first
+NEIGHBOURS = [(0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, -1), (-1, 1), (1, 1)]
+
+#shared "distance to the player" field (a libtcod dijkstra map). it is computed
+#at most once per player position and used by every chasing monster.
+player_field = None
+player_field_map = None  #the FOV map the field was made for
+player_field_origin = None  #the player position it was computed from
+
+def get_player_field():
+	global player_field, player_field_map, player_field_origin
+	if player_field is None or player_field_map != fov_map:
+		#first use, or the level's map was rebuilt
+		if player_field is not None:
+			libtcod.dijkstra_delete(player_field)
+		player_field = libtcod.dijkstra_new(fov_map, 1.41)
+		player_field_map = fov_map
+		player_field_origin = None
+
+	if player_field_origin != (player.x, player.y):
+		libtcod.dijkstra_compute(player_field, player.x, player.y)
+		player_field_origin = (player.x, player.y)
+	return player_field
+
+def invalidate_player_field():
+	#call when walls change, so the next monster turn recomputes the field
+	global player_field_origin
+	player_field_origin = None
+
 class BasicMonster:
 	global fov_map
 	#AI for a basic monster.
-	
+	#monsters chase the player along the shared distance field (see
+	#step_towards_player()). a monster whose way is blocked by other monsters
+	#computes a path around them, and follows it until the player moves or the
+	#path is blocked. each monster keeps one libtcod path object for its whole
+	#life for that.
+	path_to_target = None  #the libtcod path object
+	path_map = None  #the FOV map the path object was made for
+	path_target = None  #the cell the path leads to
+	path_next = None  #where the monster should be standing to keep following it
+
+	#how many turns had to recompute a path, and how many reused the cached one
+	path_stats = {'recomputed': 0, 'cached': 0}
+
+	def __getstate__(self):
+		#libtcod paths can't be saved; a new one is made after loading
+		state = self.__dict__.copy()
+		state.pop('path_to_target', None)
+		state.pop('path_map', None)
+		return state
+
 	def calc_path(self):
-		self.path_to_target = libtcod.path_new_using_map(fov_map, 1.41)
 		monster = self.owner
+		if self.path_to_target is None or self.path_map != fov_map:
+			#first path for this monster, or the level's map was rebuilt
+			self.free_path()
+			self.path_to_target = libtcod.path_new_using_map(fov_map, 1.41)
+			self.path_map = fov_map
+		#the path has to lead around the monsters next to us, so their cells
+		#are made unwalkable while it is computed
+		crowded = []
+		for (dx, dy) in NEIGHBOURS:
+			(x, y) = (monster.x + dx, monster.y + dy)
+			if (0 <= x < MAP_WIDTH and 0 <= y < MAP_HEIGHT and libtcod.map_is_walkable(fov_map, x, y) and
+					objects.blocking_at(x, y) not in (None, player)):
+				crowded.append((x, y))
+				libtcod.map_set_properties(fov_map, x, y, libtcod.map_is_transparent(fov_map, x, y), False)
 		libtcod.path_compute(self.path_to_target, monster.x, monster.y, player.x, player.y)
+		for (x, y) in crowded:
+			libtcod.map_set_properties(fov_map, x, y, libtcod.map_is_transparent(fov_map, x, y), True)
+		self.path_target = (player.x, player.y)
+		self.path_next = (monster.x, monster.y)
+		BasicMonster.path_stats['recomputed'] += 1
+
+	def path_is_valid(self):
+		#can the path from the last turn still be followed?
+		monster = self.owner
+		if self.path_to_target is None or self.path_map != fov_map:
+			return False
+		if self.path_target != (player.x, player.y) or self.path_next != (monster.x, monster.y):
+			return False
+		if libtcod.path_is_empty(self.path_to_target):
+			return False
+		(x, y) = libtcod.path_get(self.path_to_target, 0)
+		return not is_blocked(x, y)
+
+	def free_path(self):
+		#release the libtcod path object, if any
+		if self.path_to_target is not None:
+			libtcod.path_delete(self.path_to_target)
+			self.path_to_target = None
+			self.path_map = None
 	
+	def step_towards_player(self):
+		#step to the free neighbouring cell closest to the player, following
+		#the shared distance field. returns None if the player can't be reached
+		#that way, False if every closer cell is taken.
+		monster = self.owner
+		field = get_player_field()
+		best = libtcod.dijkstra_get_distance(field, monster.x, monster.y)
+		if best < 0:
+			return None
+
+		step = None
+		for (dx, dy) in NEIGHBOURS:
+			(x, y) = (monster.x + dx, monster.y + dy)
+			if x < 0 or y < 0 or x >= MAP_WIDTH or y >= MAP_HEIGHT:
+				continue
+			distance = libtcod.dijkstra_get_distance(field, x, y)
+			if 0 <= distance < best and not is_blocked(x, y):
+				best = distance
+				step = (dx, dy)
+
+		if step is None:
+			return False
+		monster.move(*step)
+		return True
+
 	def walk_path(self):
 		monster = self.owner
 		step_x,step_y=libtcod.path_walk(self.path_to_target, True)
-		monster.move_towards(step_x, step_y)
-		if not monster.x is None:
-			print 'Astar coord: ',monster.x,monster.y
-		else:
-			print "I'm stuck!"
+		if step_x is not None:
+			monster.move_towards(step_x, step_y)
+			self.path_next = (step_x, step_y)
 	
 	def take_turn(self):
-		#a basic monster takes its turn. if you can see it, it can see you
+		#a basic monster takes its turn. monsters that get turns always chase
+		#the player, whether it can see them or not (the far away ones sleep,
+		#see schedule_actor())
 		monster = self.owner
-		if libtcod.map_is_in_fov(fov_map, monster.x, monster.y) or True:
 
-			#move towards player if far away
-			if monster.distance_to(player) >= 2:
+		#move towards player if far away
+		if monster.distance_to(player) >= 2:
+			if self.path_is_valid():
+				#still going around the monsters that were in the way
+				BasicMonster.path_stats['cached'] += 1
+				self.walk_path()
+			elif self.step_towards_player() is False:
+				#every cell closer to the player is taken, find a way around
 				self.calc_path()
 				self.walk_path()
 
-			#close enough, attack! (if the player is still alive.)
-			elif player.fighter.hp > 0:
-				monster.fighter.attack(player)
-		monster.fighter.tick()
+		#close enough, attack! (if the player is still alive.)
+		elif player.fighter.hp > 0:
+			monster.fighter.attack(player)
 
 class ConfusedMonster:
-	#AI for a temporarily confused monster (reverts to previous AI after a while).
-	def __init__(self, old_ai, num_turns=CONFUSE_NUM_TURNS):
+	#AI for a temporarily confused monster (reverts to previous AI after a while,
+	#see end_confusion()).
+	def __init__(self, old_ai):
 		self.old_ai = old_ai
-		self.num_turns = num_turns
+
+	def free_path(self):
+		self.old_ai.free_path()
 
 	def take_turn(self):
-		if self.num_turns > 0:  #still confused...
-			#move in a random direction, and decrease the number of turns confused
-			self.owner.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1))
-			self.num_turns -= 1
-
-		else:  #restore the previous AI (this one will be deleted because it's not referenced anymore)
-			self.owner.ai = self.old_ai
-			message('The ' + self.owner.name + ' is no longer confused!', libtcod.red)
-		self.owner.fighter.tick()
-
-class Item:
-	#an item that can be picked up and used.
-	def __init__(self, use_function=None, stackable=False):
+		#move in a random direction
+		rnd = streams.get(AI)
+		self.owner.move(libtcod.random_get_int(rnd, -1, 1), libtcod.random_get_int(rnd, -1, 1))
+
+def end_confusion(monster):
+	#timed event: restore the previous AI (the confused one will be deleted
+	#because it's not referenced anymore), unless the monster died meanwhile
+	if isinstance(monster.ai, ConfusedMonster):
+		monster.ai = monster.ai.old_ai
+		message('The ' + monster.name + ' is no longer confused!', libtcod.red)
+
+def schedule_confusion_ends():
+	#older saves counted the confused turns in the AI itself, and have no
+	#end_confusion() event: give their confused monsters one
+	pending = set(id(event[3][0]) for event in scheduler.events if event[2] is end_confusion)
+	for object in objects:
+		if isinstance(object.ai, ConfusedMonster) and id(object) not in pending:
+			turns = object.ai.__dict__.pop('num_turns', CONFUSE_NUM_TURNS)
+			do_after(max(turns, 1), end_confusion, object)
+
+class Item(Slotted):
+	#an item that can be picked up and used. a stack of stackable items is one
+	#object with a count; units only become objects of their own when they
+	#are split off (see split()).
+	__slots__ = ('owner', 'use_function', 'stackable', 'count')
+
+	def __init__(self, use_function=None, stackable=False, count=1):
 		self.use_function = use_function
 		self.stackable = stackable
-		self.stack = [self]
+		self.count = count
 		
 	def stacksize(self):
-		return len(self.stack)
+		return self.count
+
+	def split(self, count=1):
+		#take count units off the stack, returning them as a new object made
+		#like this one
+		obj = copy.copy(self.owner)
+		obj.equipment_bonuses = None
+		obj.item = copy.copy(self)
+		obj.item.owner = obj
+		obj.item.count = count
+		if obj.equipment:
+			obj.equipment = copy.copy(obj.equipment)
+			obj.equipment.owner = obj
+			obj.equipment.is_equipped = False
+		self.count -= count
+		return obj
+
+	def __setstate__(self, state):
+		#older save games kept a list with an object per unit
+		if 'stack' in state:
+			state['count'] = len(state.pop('stack'))
+		Slotted.__setstate__(self, state)
 
 	def pick_up(self):
 		#add to the player's inventory and remove from the map        
 		if self.stackable:
 			#check for existing stack
-			existingindex = inventory_find(self.owner.name)
-			if existingindex == -1:
+			existing_stack = inventory.find(self.owner.name)
+			if existing_stack is None:
 				#No stack found, check if there is room in inventory to begin a new stack  
 				if len(inventory) >= 26:
 					message('Your inventory is full, cannot pick up ' + self.owner.name + '.', libtcod.red)
 				else:
 					#create a new stack
 					inventory.append(self.owner)
+					invalidate_equipment_bonuses()
 					objects.remove(self.owner)
 					message('You picked up a ' + self.owner.name + '!', libtcod.green)
 			else:
 				#add to existing stack
-				existing_stack = inventory[existingindex]
-				existing_stack.item.stack.append(self.owner)
+				existing_stack.item.count += self.count
 				objects.remove(self.owner)
 				message('You now have ' + str(existing_stack.item.stacksize()) + ' ' + self.owner.name + 's!', libtcod.green)
 		else:
@@ -618,6 +843,7 @@ class Item:
 				message('Your inventory is full, cannot pick up ' + self.owner.name + '.', libtcod.red)
 			else:
 				inventory.append(self.owner)
+				invalidate_equipment_bonuses()
 				objects.remove(self.owner)
 				message('You picked up a ' + self.owner.name + '!', libtcod.green)
 
@@ -633,17 +859,18 @@ class Item:
 
 		if self.stackable and self.stacksize() > 1:
 			#Drop 1 item of the stack
-			dropobject = self.stack.pop()
+			dropobject = self.split(1)
 			dropobject.x = player.x
 			dropobject.y = player.y
 			objects.append(dropobject)
 			message('You dropped a ' + dropobject.name + '. (' + str(self.stacksize()) + ' remaining)', libtcod.yellow)
 		else:
 			#add to the map and remove from the player's inventory. also, place it at the player's coordinates
-			objects.append(self.owner)
-			inventory.remove(self.owner)
 			self.owner.x = player.x
 			self.owner.y = player.y
+			objects.append(self.owner)
+			inventory.remove(self.owner)
+			invalidate_equipment_bonuses()
 			message('You dropped a ' + self.owner.name + '.', libtcod.yellow)
 
 	def use(self):
@@ -658,13 +885,17 @@ class Item:
 		else:
 			if self.use_function() != 'cancelled':
 				if self.stackable and self.stacksize() > 1:
-					self.stack.pop()
+					self.count -= 1
 					message('You used a ' + self.owner.name + '. (' + str(self.stacksize()) + ' remaining)', libtcod.yellow)
 				else:
 					inventory.remove(self.owner)  #destroy after use, unless it was cancelled for some reason
+					invalidate_equipment_bonuses()
  
-class Equipment:
+class Equipment(Slotted):
 	#an object that can be equipped, yielding bonuses. automatically adds the Item component.
+	__slots__ = ('owner', 'power_bonus', 'accuracy_bonus', 'defense_bonus', 'evade_bonus', 'block_bonus', 'max_hp_bonus',
+		'strength_bonus', 'agility_bonus', 'intelligence_bonus', 'oxygen_bonus', 'energy_bonus', 'slot', 'is_equipped')
+
 	def __init__(self, slot, power_bonus=0, accuracy_bonus=0, defense_bonus=0, evade_bonus=0, block_bonus=0,
 						max_hp_bonus=0,strength_bonus=0, agility_bonus=0, intelligence_bonus=0, oxygen_bonus=0, energy_bonus=0):
 		self.power_bonus = power_bonus
@@ -696,6 +927,7 @@ class Equipment:
 
 		#equip object and show a message about it
 		self.is_equipped = True
+		invalidate_equipment_bonuses()
 		if suppress_msg is not True:
 			message('Equipped ' + self.owner.name + ' on ' + self.slot + '.', libtcod.light_green)
 
@@ -703,6 +935,7 @@ class Equipment:
 		#dequip object and show a message about it
 		if not self.is_equipped: return
 		self.is_equipped = False
+		invalidate_equipment_bonuses()
 		if suppress_msg is not True:
 			message('Dequipped ' + self.owner.name + ' from ' + self.slot + '.', libtcod.light_yellow)
  
@@ -713,12 +946,6 @@ def get_equipped_in_slot(slot):  #returns the equipment in a slot, or None if it
 			return obj.equipment
 	return None
 
-def get_equipped_name_in_slot(slot):  #returns the name of the equiped item, if it exists.
-	for obj in inventory:
-		if obj.equipment and obj.equipment.slot == slot and obj.equipment.is_equipped:
-			return obj.name
-	return 'nothing'
- 
 def get_all_equipped(obj):  #returns a list of equipped items
 	if obj == player:
 		equipped_list = []
@@ -728,52 +955,66 @@ def get_all_equipped(obj):  #returns a list of equipped items
 		return equipped_list
 	else:
 		return []  #other objects have no equipment
+
+#the bonuses an Equipment can give, summed up by get_equipment_bonuses()
+EQUIPMENT_BONUSES = ('power_bonus', 'accuracy_bonus', 'defense_bonus', 'evade_bonus', 'block_bonus', 'max_hp_bonus',
+	'strength_bonus', 'agility_bonus', 'intelligence_bonus', 'oxygen_bonus', 'energy_bonus')
+
+def get_equipment_bonuses(obj):
+	#returns a dict with the summed bonuses of everything obj has equipped, plus
+	#the set of used slots under 'slots'. it is cached on the object, so the
+	#stat properties don't rescan the inventory: call invalidate_equipment_bonuses()
+	#whenever the equipment or the inventory changes.
+	bonuses = obj.equipment_bonuses
+	if bonuses is None:
+		equipped = get_all_equipped(obj)
+		bonuses = dict((name, sum(getattr(equipment, name) for equipment in equipped)) for name in EQUIPMENT_BONUSES)
+		bonuses['slots'] = frozenset(equipment.slot for equipment in equipped)
+		obj.equipment_bonuses = bonuses
+	return bonuses
+
+def invalidate_equipment_bonuses(obj=None):
+	#forget the cached bonuses (of the player by default), they'll be summed again when next needed
+	if obj is None:
+		obj = player
+	obj.equipment_bonuses = None
  
  
 def is_blocked(x, y):
 	#first test the map tile
-	if map[x][y].blocked:
+	if map.get('blocked', x, y):
 		return True
 
 	#now check for any blocking objects
-	for object in objects:
-		if object.blocks and object.x == x and object.y == y:
-			return True
-
-	return False
+	return objects.blocking_at(x, y) is not None
  
 def create_room(room):
 	global map
 	#go through the tiles in the rectangle and make them passable
-	for x in range(room.x1 + 1, room.x2):
-		for y in range(room.y1 + 1, room.y2):
-			map[x][y].blocked = False
-			map[x][y].block_sight = False
+	map.carve(room.x1 + 1, room.y1 + 1, room.x2, room.y2)
  
 def create_h_tunnel(x1, x2, y):
 	global map
 	#horizontal tunnel. min() and max() are used in case x1>x2
-	for x in range(min(x1, x2), max(x1, x2) + 1):
-		map[x][y].blocked = False
-		map[x][y].block_sight = False
+	map.carve(min(x1, x2), y, max(x1, x2) + 1, y + 1)
  
 def create_v_tunnel(y1, y2, x):
 	global map
 	#vertical tunnel
-	for y in range(min(y1, y2), max(y1, y2) + 1):
-		map[x][y].blocked = False
-		map[x][y].block_sight = False
+	map.carve(x, min(y1, y2), x + 1, max(y1, y2) + 1)
  
 def make_map(algor=None):
-	global map, objects, stairs
+	#make the level at dungeon_level: map, objects, stairs and the start
+	#position. it doesn't depend on the player, so it can run in the level
+	#generator process (see generate_level). all its random numbers come
+	#from generation_rnd.
+	global map, objects, stairs, upstairs, start
 
-	#the list of objects with just the player
-	objects = [player]
+	#the list of objects, the player is added when entering the level
+	objects = ObjectIndex()
 
 	#fill map with "blocked" tiles
-	map = [[ Tile(True)
-			 for y in range(MAP_HEIGHT) ]
-		   for x in range(MAP_WIDTH) ]
+	map = TileGrid(MAP_WIDTH, MAP_HEIGHT, True)
 
 	rooms = []
 	num_rooms = 0
@@ -781,11 +1022,11 @@ def make_map(algor=None):
 	if algor == 'old' or algor == None:
 		for r in range(MAX_ROOMS):
 			#random width and height
-			w = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-			h = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+			w = libtcod.random_get_int(generation_rnd, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+			h = libtcod.random_get_int(generation_rnd, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
 			#random position without going out of the boundaries of the map
-			x = libtcod.random_get_int(0, 0, MAP_WIDTH - w - 1)
-			y = libtcod.random_get_int(0, 0, MAP_HEIGHT - h - 1)
+			x = libtcod.random_get_int(generation_rnd, 0, MAP_WIDTH - w - 1)
+			y = libtcod.random_get_int(generation_rnd, 0, MAP_HEIGHT - h - 1)
 
 			#"Rect" class makes rectangles easier to work with
 			new_room = Rect(x, y, w, h)
@@ -811,8 +1052,7 @@ def make_map(algor=None):
 
 				if num_rooms == 0:
 					#this is the first room, where the player starts at
-					player.x = new_x
-					player.y = new_y
+					start = (new_x, new_y)
 				else:
 					#all rooms after the first:
 					#connect it to the previous room with a tunnel
@@ -821,7 +1061,7 @@ def make_map(algor=None):
 					(prev_x, prev_y) = rooms[num_rooms-1].center()
 
 					#draw a coin (random number that is either 0 or 1)
-					if libtcod.random_get_int(0, 0, 1) == 1:
+					if libtcod.random_get_int(generation_rnd, 0, 1) == 1:
 						#first move horizontally, then vertically
 						create_h_tunnel(prev_x, new_x, prev_y)
 						create_v_tunnel(prev_y, new_y, new_x)
@@ -839,6 +1079,13 @@ def make_map(algor=None):
 		objects.append(stairs)
 		stairs.send_to_back()  #so it's drawn below the monsters
 
+		#stairs back up, where the player starts
+		upstairs = None
+		if dungeon_level > 1:
+			upstairs = Object(start[0], start[1], '>', 'stairs up', libtcod.white, always_visible=True)
+			objects.append(upstairs)
+			upstairs.send_to_back()
+
 def place_objects(room):
 
 	place_monsters(room)
@@ -849,130 +1096,98 @@ def place_monsters(room):
 	max_monsters = from_dungeon_level([[1, 1], [2, 4], [3, 6]])
 
 	#chance of each monster
-	monster_chances = {}
-	for monster_name in config.get('lists', 'monster list').split(', '):
-		chance_table = json.loads(config.get(monster_name, 'chance'))
-		monster_chances[monster_name] = from_dungeon_level(chance_table)
-
-
+	monster_choice = templates.monster_choice(dungeon_level)
 
 	# remember unique monsters
 	uniques = []
 
 	#choose random number of monsters
-	num_monsters = libtcod.random_get_int(0, 0, max_monsters)
+	num_monsters = libtcod.random_get_int(generation_rnd, 0, max_monsters)
 
 	for i in range(num_monsters):
 		#choose random spot for this monster
-		x = libtcod.random_get_int(0, room.x1+1, room.x2-1)
-		y = libtcod.random_get_int(0, room.y1+1, room.y2-1)
+		(x, y) = roll_ranges(((room.x1+1, room.x2-1), (room.y1+1, room.y2-1)), generation_rnd)
 
 		#only place it if the tile is not blocked
 		if not is_blocked(x, y):
 			# choose a random monster
-			choice = random_choice(monster_chances)
-			
-			# load the monster data from the config
-			monster = dict(config.items(choice))
+			choice = monster_choice.choose(generation_rnd)
+			template = templates.monsters[choice]
 			
 			# do not create multiple unique monsters
-			if monster['unique'] == 'True':
+			if template.unique:
 				if choice in uniques:
 					continue
 				else:
 					uniques.append(choice)
 			
-			
-			# build the monster components (hp, defense, power, xp, death_function=None, species='Humanoid', evade = 10, block = 0, accuracy = 12):
-			fighter_component = Fighter(
-				hp=int(monster['hp']),
-				defense=int(monster['defense']),
-				power=int(monster['power']),
-				xp=int(monster['xp']),
-				death_function=globals().get(monster['death_function'], None),
-				species = str(get_config(monster, 'species', 'Humanoid')),
-				evade = int(get_config(monster, 'evade', '10')),
-				block = int(get_config(monster, 'block', '0')),
-				accuracy = int(get_config(monster, 'accuracy', '12')))
-				
-			# this gets a class object by name
-			ai_class = globals().get(monster['ai_component'])
-			
-			# and this instanstiates it if not None
-			ai_component = ai_class and ai_class() or None
-			
-			# finally we assemble the monster object
-			monster = Object(x, y, monster['char'], choice,
-				libtcod.Color(*tuple(json.loads(monster['color']))),
-				blocks=True, fighter=fighter_component, ai=ai_component)
+			monster = spawn_monster(template, x, y)
 			objects.append(monster)
 			print 'Placed a ' + choice + ' at ' + str(x) + ',' + str(y) + '.'
 
+def spawn_monster(template, x, y):
+	#build a monster object from a MonsterTemplate (see templates.py)
+	fighter_component = Fighter(
+		hp=template.hp,
+		defense=template.defense,
+		power=template.power,
+		xp=template.xp,
+		death_function=template.death_function,
+		species=template.species,
+		evade=template.evade,
+		block=template.block,
+		accuracy=template.accuracy,
+		speed=template.speed)
+
+	# instanstiate the AI class, if there is one
+	ai_class = template.ai_component
+	ai_component = ai_class and ai_class() or None
+
+	return Object(x, y, template.char, template.name, libtcod.Color(*template.color),
+		blocks=True, fighter=fighter_component, ai=ai_component)
+
 def place_items(room):
 
 	#chance of each item (by default they have a chance of 0 at level 1, which then goes up)
-	item_chances = {}
-	for item_name in config.get('lists', 'item list').split(', '):
-		chance_table = json.loads(config.get(item_name, 'chance'))
-		item_chances[item_name] = from_dungeon_level(chance_table)
+	item_choice = templates.item_choice(dungeon_level)
 
 	#maximum number of items per room
 	max_items = from_dungeon_level([[1, 1], [2, 4]])
 
 	#choose random number of items
-	num_items = libtcod.random_get_int(0, 0, max_items)
+	num_items = libtcod.random_get_int(generation_rnd, 0, max_items)
 
 	for i in range(num_items):
 		#choose random spot for this item
-		x = libtcod.random_get_int(0, room.x1+1, room.x2-1)
-		y = libtcod.random_get_int(0, room.y1+1, room.y2-1)
+		(x, y) = roll_ranges(((room.x1+1, room.x2-1), (room.y1+1, room.y2-1)), generation_rnd)
 
 		#only place it if the tile is not blocked
 		if not is_blocked(x, y):
-			choice = random_choice(item_chances)
-
-			# load the item data from the config
-			item = dict(config.items(choice))
-
-			#First, we need to determine if it's an item or equipment.
-			item_component = None
-			equipment_component = None
-
-			if item['type'] == 'item':
-				#build the item component, using
-				#(self, use_function=None, stackable=False)
-				item_component = Item(
-					stackable=bool(item['stackable']),
-					use_function=globals().get(item['use_function'], None))
-			elif item['type'] == 'equipment':
-				#build the equipment component, using
-				#(self, slot, power_bonus=0, accuracy_bonus=0, defense_bonus=0, evade_bonus=0, block_bonus=0, max_hp_bonus=0,strength_bonus=0, agility_bonus=0, intelligence_bonus=0, oxygen_bonus=0, energy_bonus=0):
-				equipment_component = Equipment(
-					slot=str(item['slot']), #We want an error to occur if slot is empty
-					power_bonus = int(get_config(item, 'power', 0)), #get_config() lets us not need to define every single stat on an item in the config file
-					accuracy_bonus = int(get_config(item, 'accuracy', 0)),
-					defense_bonus = int(get_config(item, 'defense', 0)),
-					evade_bonus = int(get_config(item, 'evade', 0)),
-					block_bonus = int(get_config(item, 'block', 0)),
-					max_hp_bonus = int(get_config(item, 'max_hp', 0)),
-					strength_bonus = int(get_config(item, 'strength', 0)),
-					agility_bonus = int(get_config(item, 'agility', 0)),
-					intelligence_bonus = int(get_config(item, 'intelligence', 0)),
-					oxygen_bonus = int(get_config(item, 'oxygen', 0)))
-			else:
-				#We probably messed up if this happens.
-				print 'WARN: Made an item without any components.'
-			
-			# finally we assemble the object
-			#Reminder: Here are the inputs we can fill, if we so choose.
-			#(x, y, char, name, color, blocks=False, always_visible=False, fighter=None, ai=None, player_stats=None, item=None, equipment=None)
-			item = Object(x, y, item['char'], choice,
-				libtcod.Color(*tuple(json.loads(item['color']))),
-				blocks=False, item=item_component, equipment=equipment_component)
+			choice = item_choice.choose(generation_rnd)
+			item = spawn_item(templates.items[choice], x, y)
 			objects.append(item)
 			print 'Placed a ' + choice + ' at ' + str(x) + ',' + str(y) + '.'
 			item.send_to_back()  #items appear below other objects
-			item.always_visible = True  #items are visible even out-of-FOV, if in an explored area
+
+def spawn_item(template, x, y):
+	#build an item object from an ItemTemplate (see templates.py)
+	#First, we need to determine if it's an item or equipment.
+	item_component = None
+	equipment_component = None
+
+	if template.type == 'item':
+		item_component = Item(stackable=template.stackable, use_function=template.use_function)
+	elif template.type == 'equipment':
+		#the template holds (argument, value) pairs like ('power_bonus', 4)
+		equipment_component = Equipment(slot=template.slot, **dict(template.bonuses))
+	else:
+		#We probably messed up if this happens.
+		print 'WARN: Made an item without any components.'
+
+	item = Object(x, y, template.char, template.name, libtcod.Color(*template.color),
+		blocks=False, item=item_component, equipment=equipment_component)
+	item.always_visible = True  #items are visible even out-of-FOV, if in an explored area
+	return item
 
 
 
@@ -1003,14 +1218,14 @@ def get_names_under_mouse():
 	(x, y) = (camera_x + x, camera_y + y)  #from screen to map coordinates
 
 	#create a list with the names of all objects at the mouse's coordinates and in FOV
-	names = [obj.name for obj in objects
-		if obj.x == x and obj.y == y and libtcod.map_is_in_fov(fov_map, obj.x, obj.y)]
+	names = [obj.name for obj in objects.at(x, y)
+		if is_visible(obj.x, obj.y)]
 
 	names = ', '.join(names)  #join the names, separated by commas
 	return names.title()
 
 def move_camera(target_x, target_y):
-	global camera_x, camera_y, fov_recompute
+	global camera_x, camera_y, map_redraw
 
 	#new camera coordinates (top-left corner of the screen relative to the map)
 	x = target_x - CAMERA_WIDTH / 2  #coordinates so that the target is at the center of the screen
@@ -1022,7 +1237,7 @@ def move_camera(target_x, target_y):
 	if x > MAP_WIDTH - CAMERA_WIDTH - 1: x = MAP_WIDTH - CAMERA_WIDTH - 1
 	if y > MAP_HEIGHT - CAMERA_HEIGHT - 1: y = MAP_HEIGHT - CAMERA_HEIGHT - 1
 
-	if x != camera_x or y != camera_y: fov_recompute = True
+	if x != camera_x or y != camera_y: map_redraw = True  #the FOV is the same, it's just seen from elsewhere
 
 	(camera_x, camera_y) = (x, y)
 
@@ -1035,88 +1250,240 @@ def to_camera_coordinates(x, y):
 
 	return (x, y)
 
+def compute_fov_mask():
+	#returns a map layer (see TileGrid.new_layer) set for the tiles in the player's FOV.
+	#the FOV can't reach past the torch radius, so only that square is asked for.
+	mask = map.new_layer(False)
+	(x1, y1) = (0, 0)
+	(x2, y2) = (map.width, map.height)
+	if TORCH_RADIUS > 0:
+		(x1, y1) = (max(x1, player.x - TORCH_RADIUS), max(y1, player.y - TORCH_RADIUS))
+		(x2, y2) = (min(x2, player.x + TORCH_RADIUS + 1), min(y2, player.y + TORCH_RADIUS + 1))
+
+	for x in range(x1, x2):
+		for y in range(y1, y2):
+			if libtcod.map_is_in_fov(fov_map, x, y):
+				mask[map.index(x, y)] = 1
+	return mask
+
+#the player's FOV as a map layer, made by recompute_fov(), see is_visible()
+visible_mask = None
+#true when the map background has to be drawn again (the FOV changed or the camera moved)
+map_redraw = True
+
+def recompute_fov():
+	#compute the FOV at the player's position, once, and keep it in visible_mask
+	global fov_recompute, visible_mask, map_redraw
+	fov_recompute = False
+	libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+	visible_mask = compute_fov_mask()
+	map_redraw = True
+
+def is_visible(x, y):
+	#true if the player sees tile (x, y). instead of asking libtcod, it looks at
+	#the FOV cached in visible_mask, which is computed again first if needed.
+	if fov_recompute:
+		recompute_fov()
+	if x < 0 or y < 0 or x >= map.width or y >= map.height:
+		return False
+	return bool(visible_mask[x * map.height + y])
+
+def render_map_background(visible):
+	#set the background of every cell of the camera window according to the FOV,
+	#and explore what's visible. the colors are built as whole R, G and B arrays
+	#and sent to the console in one call instead of one call per cell.
+	dark_wall = (color_dark_wall.r, color_dark_wall.g, color_dark_wall.b)
+	dark_ground = (color_dark_ground.r, color_dark_ground.g, color_dark_ground.b)
+	light_wall = (color_light_wall.r, color_light_wall.g, color_light_wall.b)
+	light_ground = (color_light_ground.r, color_light_ground.g, color_light_ground.b)
+
+	if numpy_available:
+		#the map layers are indexed [x, y], the console wants rows of y
+		window = (slice(camera_x, camera_x + CAMERA_WIDTH), slice(camera_y, camera_y + CAMERA_HEIGHT))
+		explored = map.view('explored')[window]
+		visible = visible.reshape(map.width, map.height)[window]
+		explored |= visible  #since it's visible, explore it
+		wall = map.view('block_sight')[window].T
+		(explored, visible) = (explored.T, visible.T)
+
+		#unexplored areas (and the part of the console outside the camera) stay black
+		back = numpy.zeros((MAP_HEIGHT, MAP_WIDTH, 3), dtype=numpy.int_)
+		cells = back[:CAMERA_HEIGHT, :CAMERA_WIDTH]
+		cells[explored & wall] = dark_wall
+		cells[explored & ~wall] = dark_ground
+		cells[visible & wall] = light_wall
+		cells[visible & ~wall] = light_ground
+		libtcod.console_fill_background(con, back[:, :, 0].ravel(), back[:, :, 1].ravel(), back[:, :, 2].ravel())
+		return
+
+	r = [0] * (MAP_WIDTH * MAP_HEIGHT)
+	g = [0] * (MAP_WIDTH * MAP_HEIGHT)
+	b = [0] * (MAP_WIDTH * MAP_HEIGHT)
+	for y in range(CAMERA_HEIGHT):
+		for x in range(CAMERA_WIDTH):
+			i = map.index(camera_x + x, camera_y + y)
+			wall = map.block_sight[i]
+			if visible[i]:
+				map.explored[i] = 1  #since it's visible, explore it
+				color = light_wall if wall else light_ground
+			elif map.explored[i]:
+				#if it's not visible right now, the player can only see it if it's explored
+				color = dark_wall if wall else dark_ground
+			else:
+				continue
+			cell = y * MAP_WIDTH + x
+			(r[cell], g[cell], b[cell]) = color
+	libtcod.console_fill_background(con, r, g, b)
+
+#what render_objects() last put on the map console: (x, y) -> (char, (r, g, b))
+drawn_sprites = {}
+
+def render_objects(cleared=False):
+	#draw the objects the player can see. their characters and colors are
+	#collected for the camera window, then the whole console gets its
+	#characters and foreground colors in two calls: the cells without an
+	#object are set to spaces, so nothing has to be erased when objects move.
+	#nothing is sent at all if the same sprites are already on the console
+	#(unless it was cleared).
+	global drawn_sprites
+	sprites = {}
+	(x2, y2) = (camera_x + CAMERA_WIDTH, camera_y + CAMERA_HEIGHT)
+	#all objects in the list, except the player. we want it to always
+	#appear over all other objects! so it's added last.
+	for object in objects:
+		if (object is not player and camera_x <= object.x < x2 and camera_y <= object.y < y2 and
+				object.is_seen()):
+			sprites[(object.x - camera_x, object.y - camera_y)] = (object.char, object.color)
+	if player.is_seen():
+		sprites[(player.x - camera_x, player.y - camera_y)] = (player.char, player.color)
+	for (cell, (char, color)) in sprites.items():
+		sprites[cell] = (ord(char) if isinstance(char, str) else char, (color.r, color.g, color.b))
+	if sprites == drawn_sprites and not cleared:
+		return
+	drawn_sprites = sprites
+
+	n = MAP_WIDTH * MAP_HEIGHT
+	if numpy_available:
+		chars = numpy.empty(n, dtype=numpy.int_)
+		chars.fill(ord(' '))
+		fore = numpy.zeros((3, n), dtype=numpy.int_)
+		for ((x, y), (char, color)) in sprites.items():
+			chars[y * MAP_WIDTH + x] = char
+			fore[:, y * MAP_WIDTH + x] = color
+		(r, g, b) = fore
+	else:
+		chars = [ord(' ')] * n
+		(r, g, b) = ([0] * n, [0] * n, [0] * n)
+		for ((x, y), (char, color)) in sprites.items():
+			cell = y * MAP_WIDTH + x
+			chars[cell] = char
+			(r[cell], g[cell], b[cell]) = color
+	libtcod.console_fill_char(con, chars)
+	libtcod.console_fill_foreground(con, r, g, b)
+
 def render_all():
 	global fov_map, color_dark_wall, color_light_wall
 	global color_dark_ground, color_light_ground
-	global fov_recompute
+	global map_redraw
 
 	move_camera(player.x, player.y)
 
 	if fov_recompute:
 		#recompute FOV if needed (the player moved or something)
-		fov_recompute = False
-		libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
-		libtcod.console_clear(con)
+		recompute_fov()
+	if profiler: profiler.mark('fov')
 
-		#go through all tiles, and set their background color according to the FOV
-		for y in range(CAMERA_HEIGHT):
-			for x in range(CAMERA_WIDTH):
-				(map_x, map_y) = (camera_x + x, camera_y + y)
-				visible = libtcod.map_is_in_fov(fov_map, map_x, map_y)
-
-				wall = map[map_x][map_y].block_sight
-				if not visible:
-					#if it's not visible right now, the player can only see it if it's explored
-					if map[map_x][map_y].explored:
-						if wall:
-							libtcod.console_set_char_background(con, x, y, color_dark_wall, libtcod.BKGND_SET)
-						else:
-							libtcod.console_set_char_background(con, x, y, color_dark_ground, libtcod.BKGND_SET)
-				else:
-					#it's visible
-					if wall:
-						libtcod.console_set_char_background(con, x, y, color_light_wall, libtcod.BKGND_SET )
-					else:
-						libtcod.console_set_char_background(con, x, y, color_light_ground, libtcod.BKGND_SET )
-					#since it's visible, explore it
-					map[map_x][map_y].explored = True
+	cleared = map_redraw
+	if map_redraw:
+		#draw the map again if the FOV changed or the camera moved
+		map_redraw = False
+		libtcod.console_clear(con)
+		render_map_background(visible_mask)
+	if profiler: profiler.mark('map')
 
-	#draw all objects in the list, except the player. we want it to
-	#always appear over all other objects! so it's drawn later.
-	for object in objects:
-		if object != player:
-			object.draw()
-	player.draw()
+	render_objects(cleared)
 
 	#blit the contents of "con" to the root console
 	libtcod.console_blit(con, 0, 0, MAP_WIDTH, MAP_HEIGHT, 0, 0, 0)
+	if profiler: profiler.mark('objects')
 
+	#draw what changed in the GUI panel and the message log
+	render_panel()
 
-	#prepare to render the GUI panel
-	libtcod.console_set_default_background(panel, libtcod.black)
-	libtcod.console_clear(panel)
-	libtcod.console_clear(log)
+	#blit the contents of "panel" to the root console
+	libtcod.console_blit(panel, 0, 0, PANEL_WIDTH, PANEL_HEIGHT, 0, PANEL_X, 0)
+	if profiler: profiler.mark('panel')
 
-	#print the game messages, one line at a time
-	y = 1
-	for (line, color) in game_msgs:
-		libtcod.console_set_default_foreground(log, color)
-		libtcod.console_print_ex(log, MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
-		y += 1
+	render_log()
+
+	#blit the contents of "log" to the root console
+	libtcod.console_blit(log, 0, 0, LOG_WIDTH, LOG_HEIGHT, 0, 0, SCREEN_HEIGHT - LOG_Y)
+	if profiler: profiler.mark('log')
+
+#what the panel and the log were last drawn with: region name -> values.
+#a region is only drawn again when its values change.
+panel_cache = {}
+
+#equipment slots shown in the panel, in order
+PANEL_SLOTS = ('right hand', 'left hand', 'suit', 'exosuit', 'head', 'eyes', 'neck', 'belt', 'back', 'gloves', 'feet')
+
+def clear_rows(console, y, height, width):
+	libtcod.console_set_default_background(console, libtcod.black)
+	libtcod.console_rect(console, 0, y, width, height, True, libtcod.BKGND_SET)
+
+def render_panel():
+	#each region of the side panel is a band of rows, cleared and drawn whole
+	#when one of the values it shows changed
+	fighter = player.fighter
+	stats = player.player_stats
+	regions = (
+		('header', 0, 4, draw_panel_header, (player.name, stats.title, stats.race)),
+		('bars', 4, 8, draw_panel_bars, (fighter.hp, fighter.max_hp, fighter.xp, LEVEL_UP_BASE + player.level * LEVEL_UP_FACTOR,
+			stats.energy, stats.max_energy, stats.oxygen, stats.max_oxygen)),
+		('stats', 12, 14, draw_panel_stats, (dungeon_level, player.level, fighter.defense, stats.strength,
+			fighter.evade, stats.agility, fighter.block, stats.intelligence, scheduler.time // TURN_LENGTH)),
+		('equipment', 26, 15, draw_panel_equipment, equipped_names()))
+	for (name, y, height, draw, values) in regions:
+		if panel_cache.get(name) != values:
+			panel_cache[name] = values
+			clear_rows(panel, y, height, PANEL_WIDTH)
+			draw(*values)
+
+def equipped_names():
+	#the names of the items equipped in PANEL_SLOTS, with one look at the inventory
+	names = {}
+	for obj in inventory:
+		if obj.equipment and obj.equipment.is_equipped:
+			names.setdefault(obj.equipment.slot, obj.name)
+	return tuple(names.get(slot, 'nothing') for slot in PANEL_SLOTS)
 
+def draw_panel_header(name, title, race):
 	#show the player's stats
 	libtcod.console_set_default_foreground(panel, libtcod.yellow)
-	libtcod.console_print_ex(panel, 1, 1, libtcod.BKGND_NONE, libtcod.LEFT, player.name)
-	libtcod.console_print_ex(panel, 1, 2, libtcod.BKGND_NONE, libtcod.LEFT, str(player.player_stats.title))
-	libtcod.console_print_ex(panel, 1, 3, libtcod.BKGND_NONE, libtcod.LEFT, str(player.player_stats.race))
+	libtcod.console_print_ex(panel, 1, 1, libtcod.BKGND_NONE, libtcod.LEFT, name)
+	libtcod.console_print_ex(panel, 1, 2, libtcod.BKGND_NONE, libtcod.LEFT, str(title))
+	libtcod.console_print_ex(panel, 1, 3, libtcod.BKGND_NONE, libtcod.LEFT, str(race))
+
+def draw_panel_bars(hp, max_hp, xp, level_up_xp, energy, max_energy, oxygen, max_oxygen):
 	libtcod.console_set_default_foreground(panel, libtcod.white)
 	bar_y = 4
-	render_bar(1, bar_y, BAR_WIDTH, 'HP', player.fighter.hp, player.fighter.max_hp,
+	render_bar(1, bar_y, BAR_WIDTH, 'HP', hp, max_hp,
 			libtcod.dark_red, libtcod.darkest_red)
 	bar_y += 2
-	render_bar(1, bar_y, BAR_WIDTH, 'XP', player.fighter.xp, LEVEL_UP_BASE + player.level * LEVEL_UP_FACTOR,
+	render_bar(1, bar_y, BAR_WIDTH, 'XP', xp, level_up_xp,
 			libtcod.green, libtcod.darker_green)
 	bar_y += 2
 	#This assumes the player is a non-synth.
-	if player.player_stats.max_energy != 0:
-		render_bar(1, bar_y, BAR_WIDTH, 'Energy', player.player_stats.energy, player.player_stats.max_energy,
+	if max_energy != 0:
+		render_bar(1, bar_y, BAR_WIDTH, 'Energy', energy, max_energy,
 				libtcod.darker_yellow, libtcod.darkest_yellow)
 		bar_y += 2
-	if player.player_stats.max_oxygen != 0:
-		render_bar(1, bar_y, BAR_WIDTH, 'Oxy', player.player_stats.oxygen, player.player_stats.max_oxygen,
+	if max_oxygen != 0:
+		render_bar(1, bar_y, BAR_WIDTH, 'Oxy', oxygen, max_oxygen,
 			libtcod.light_blue, libtcod.darker_blue)
 		bar_y += 2
 
+def draw_panel_stats(dungeon_level, level, defense, strength, evade, agility, block, intelligence, time):
 	yellow_text_y = 12
 	yellow_text_left_x = 8
 	yellow_text_right_x = 22
@@ -1147,39 +1514,7 @@ def render_all():
 	yellow_text_y += 2
 	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Money:')
 	libtcod.console_print_ex(panel, yellow_text_right_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Time:')
-	yellow_text_y += 2
-
-	libtcod.console_print_ex(panel, PANEL_WIDTH / 2, yellow_text_y, libtcod.BKGND_NONE, libtcod.CENTER, '--Equipped Items--')
-	yellow_text_y += 1
-	
-	libtcod.console_set_default_foreground(panel, libtcod.green) # Equipment
-	#Also, yes, we're using yellow_text_y for green text.
-
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'R Hand:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'L Hand:')
-	yellow_text_y += 2
-	
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Suit:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Exosuit:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Head:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Eyes:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Neck:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Belt:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Back:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Gloves:')
-	yellow_text_y += 1
-	libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, 'Feet:')
-	yellow_text_y += 1
 
-	
 	white_text_y = 17
 	white_text_left_x = yellow_text_left_x + 2
 	white_text_right_x = yellow_text_right_x + 2
@@ -1187,66 +1522,79 @@ def render_all():
 	libtcod.console_set_default_foreground(panel, libtcod.white)
 	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, 'Asteroid : ' + str(dungeon_level))
 	white_text_y += 1
-	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(player.level))
+	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(level))
 	white_text_y += 2
 	
-	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(player.fighter.defense))
-	libtcod.console_print_ex(panel, white_text_right_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(player.player_stats.strength))
+	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(defense))
+	libtcod.console_print_ex(panel, white_text_right_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(strength))
 	white_text_y += 1
-	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(player.fighter.evade))
-	libtcod.console_print_ex(panel, white_text_right_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(player.player_stats.agility))
+	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(evade))
+	libtcod.console_print_ex(panel, white_text_right_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(agility))
 	white_text_y += 1
-	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(player.fighter.block))
-	libtcod.console_print_ex(panel, white_text_right_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(player.player_stats.intelligence))
+	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(block))
+	libtcod.console_print_ex(panel, white_text_right_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(intelligence))
 	white_text_y += 2
-	libtcod.console_print_ex(panel, white_text_right_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(player.fighter.tick_total))
+	libtcod.console_print_ex(panel, white_text_right_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, str(time))
 	libtcod.console_print_ex(panel, white_text_left_x, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, "0") #NYI
-	white_text_y += 3
-	
 
+def draw_panel_equipment(*names):
+	yellow_text_y = 26
+	yellow_text_left_x = 8
+	libtcod.console_set_default_foreground(panel, libtcod.yellow)
+	libtcod.console_print_ex(panel, PANEL_WIDTH / 2, yellow_text_y, libtcod.BKGND_NONE, libtcod.CENTER, '--Equipped Items--')
+	yellow_text_y += 1
 	
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('right hand'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('left hand'))
-	white_text_y += 2
-
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('suit'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('exosuit'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('head'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('eyes'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('neck'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('belt'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('back'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('gloves'))
-	white_text_y += 1
-	libtcod.console_print_ex(panel, 10, white_text_y, libtcod.BKGND_NONE, libtcod.LEFT, get_equipped_name_in_slot('feet'))
-	white_text_y += 2
+	#one line per slot of PANEL_SLOTS, with the slot's name in green and the
+	#item in white. there's a blank line after the hands.
+	for (label, name) in zip(('R Hand:', 'L Hand:', 'Suit:', 'Exosuit:', 'Head:', 'Eyes:', 'Neck:', 'Belt:', 'Back:', 'Gloves:', 'Feet:'), names):
+		libtcod.console_set_default_foreground(panel, libtcod.green)
+		libtcod.console_print_ex(panel, yellow_text_left_x, yellow_text_y, libtcod.BKGND_NONE, libtcod.RIGHT, label)
+		libtcod.console_set_default_foreground(panel, libtcod.white)
+		libtcod.console_print_ex(panel, 10, yellow_text_y, libtcod.BKGND_NONE, libtcod.LEFT, name)
+		yellow_text_y += 2 if label == 'L Hand:' else 1
+	yellow_text_y += 1
 	libtcod.console_set_default_foreground(panel, libtcod.yellow)
-	libtcod.console_print_ex(panel, PANEL_WIDTH / 2, white_text_y, libtcod.BKGND_NONE, libtcod.CENTER, '--Abilities--')
+	libtcod.console_print_ex(panel, PANEL_WIDTH / 2, yellow_text_y, libtcod.BKGND_NONE, libtcod.CENTER, '--Abilities--')
+
+def render_log():
+	#print the game messages, one line at a time, when there are new ones
+	shown = (game_msgs, game_msgs.version)
+	if panel_cache.get('messages') != shown:
+		panel_cache['messages'] = shown
+		clear_rows(log, 1, LOG_HEIGHT - 1, LOG_WIDTH)
+		y = 1
+		for (line, color) in game_msgs.visible_lines():
+			libtcod.console_set_default_foreground(log, color)
+			libtcod.console_print_ex(log, MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
+			y += 1
 
 	#display names of objects under the mouse
-	libtcod.console_set_default_foreground(log, libtcod.light_gray)
-	libtcod.console_print_ex(log, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, get_names_under_mouse())
-
-	#blit the contents of "panel" to the root console
-	libtcod.console_blit(panel, 0, 0, PANEL_WIDTH, PANEL_HEIGHT, 0, PANEL_X, 0)
-
-	#blit the contents of "log" to the root console
-	libtcod.console_blit(log, 0, 0, LOG_WIDTH, LOG_HEIGHT, 0, 0, SCREEN_HEIGHT - LOG_Y)
+	names = get_names_under_mouse()
+	if panel_cache.get('names') != names:
+		panel_cache['names'] = names
+		panel_cache.pop('profile', None)  #cleared with the line
+		clear_rows(log, 0, 1, LOG_WIDTH)
+		libtcod.console_set_default_foreground(log, libtcod.light_gray)
+		libtcod.console_print_ex(log, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, names)
+
+	#the frame times when profiling, updated about once a second
+	if profiler:
+		if profiler.count % LIMIT_FPS == 0 or 'profile text' not in panel_cache:
+			panel_cache['profile text'] = profiler.overlay_text()
+		text = panel_cache['profile text']
+		if panel_cache.get('profile') != text:
+			panel_cache['profile'] = text
+			libtcod.console_set_default_background(log, libtcod.black)
+			libtcod.console_rect(log, LOG_WIDTH - PROFILE_WIDTH, 0, PROFILE_WIDTH, 1, True, libtcod.BKGND_SET)
+			libtcod.console_set_default_foreground(log, libtcod.yellow)
+			libtcod.console_print_ex(log, LOG_WIDTH - 1, 0, libtcod.BKGND_NONE, libtcod.RIGHT, text)
 
 def rest():
 	if player.fighter.hp == player.fighter.max_hp:
 		message('You are already at full health.')
 		player_action = 'didnt-take-turn'
 	for obj in objects:
-		if libtcod.map_is_in_fov(fov_map, obj.x, obj.y) and obj.fighter and obj is not player: #Suspend resting early if a monster is seen.
+		if is_visible(obj.x, obj.y) and obj.fighter and obj is not player: #Suspend resting early if a monster is seen.
 			message('There is a ' + str(obj.name) + ' nearby!',libtcod.red)
 			player_action = 'didnt-take-turn'
 		else:
@@ -1261,11 +1609,7 @@ def player_move_or_attack(dx, dy):
 	y = player.y + dy
 
 	#try to find an attackable object there
-	target = None
-	for object in objects:
-		if object.fighter and object.x == x and object.y == y:
-			target = object
-			break
+	target = objects.fighter_at(x, y)
 
 	#attack if target found, move otherwise
 	if target is not None:
@@ -1278,7 +1622,6 @@ def player_move_or_attack(dx, dy):
 			player.player_stats.breathe(1)
 		else: #Don't waste a turn if we bumped into a wall.
 			return 'didnt-take-turn'
-	player.fighter.tick()
 	
 
 def menu(header, options, width, transparency=0.7, return_string=False):
@@ -1348,13 +1691,45 @@ def inventory_menu(header):
 	if index is None or len(inventory) == 0: return None
 	return inventory[index].item
 
-def inventory_find(itemname):
-	#returns first index of item or -1 if the item is not found
-	itemindex = -1
-	for item in inventory:
-		if item.name == itemname:
-			itemindex = inventory.index(item)
-	return itemindex
+def message_history():
+	#show every message of the game, newest at the bottom. the arrow keys and
+	#page up/down scroll, any other key closes the window.
+	lines = game_msgs.history_lines()
+	width = MSG_WIDTH + 2 * MSG_X
+	height = SCREEN_HEIGHT - 2
+	rows = height - 2  #below the title, above the help line
+	last_top = max(0, len(lines) - rows)
+	top = last_top
+
+	window = libtcod.console_new(width, height)
+	while not libtcod.console_is_window_closed():
+		libtcod.console_clear(window)
+		libtcod.console_set_default_foreground(window, libtcod.yellow)
+		libtcod.console_print_ex(window, width / 2, 0, libtcod.BKGND_NONE, libtcod.CENTER, '--Message history--')
+		y = 1
+		for (line, color) in lines[top:top + rows]:
+			libtcod.console_set_default_foreground(window, color)
+			libtcod.console_print_ex(window, MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
+			y += 1
+		libtcod.console_set_default_foreground(window, libtcod.light_gray)
+		libtcod.console_print_ex(window, width / 2, height - 1, libtcod.BKGND_NONE, libtcod.CENTER,
+			'Up/Down and PgUp/PgDn to scroll, any other key to close')
+		libtcod.console_blit(window, 0, 0, width, height, 0, (SCREEN_WIDTH - width) / 2, 1, 1.0, 0.9)
+		libtcod.console_flush()
+
+		key = libtcod.console_wait_for_keypress(True)
+		if key.vk == libtcod.KEY_UP or key.vk == libtcod.KEY_KP8:
+			top -= 1
+		elif key.vk == libtcod.KEY_DOWN or key.vk == libtcod.KEY_KP2:
+			top += 1
+		elif key.vk == libtcod.KEY_PAGEUP or key.vk == libtcod.KEY_KP9:
+			top -= rows
+		elif key.vk == libtcod.KEY_PAGEDOWN or key.vk == libtcod.KEY_KP3:
+			top += rows
+		else:
+			break
+		top = max(0, min(top, last_top))
+	libtcod.console_delete(window)
 
 def msgbox(text, width=50):
 	menu(text, [], width)  #use menu() as a sort of "message box"
@@ -1423,7 +1798,7 @@ def text_input():
 	return command
 
 def handle_keys():
-	global key
+	global key, map_redraw
 
 	if key.vk == libtcod.KEY_ENTER and key.lalt:
 		#Alt+Enter: toggle fullscreen
@@ -1435,24 +1810,23 @@ def handle_keys():
 	if game_state == 'playing':
 		#movement keys
 		if key.vk == libtcod.KEY_UP or key.vk == libtcod.KEY_KP8:
-			player_move_or_attack(0, -1)
+			return player_move_or_attack(0, -1)
 		elif key.vk == libtcod.KEY_DOWN or key.vk == libtcod.KEY_KP2:
-			player_move_or_attack(0, 1)
+			return player_move_or_attack(0, 1)
 		elif key.vk == libtcod.KEY_LEFT or key.vk == libtcod.KEY_KP4:
-			player_move_or_attack(-1, 0)
+			return player_move_or_attack(-1, 0)
 		elif key.vk == libtcod.KEY_RIGHT or key.vk == libtcod.KEY_KP6:
-			player_move_or_attack(1, 0)
+			return player_move_or_attack(1, 0)
 		elif key.vk == libtcod.KEY_HOME or key.vk == libtcod.KEY_KP7:
-			player_move_or_attack(-1, -1)
+			return player_move_or_attack(-1, -1)
 		elif key.vk == libtcod.KEY_PAGEUP or key.vk == libtcod.KEY_KP9:
-			player_move_or_attack(1, -1)
+			return player_move_or_attack(1, -1)
 		elif key.vk == libtcod.KEY_END or key.vk == libtcod.KEY_KP1:
-			player_move_or_attack(-1, 1)
+			return player_move_or_attack(-1, 1)
 		elif key.vk == libtcod.KEY_PAGEDOWN or key.vk == libtcod.KEY_KP3:
-			player_move_or_attack(1, 1)
+			return player_move_or_attack(1, 1)
 		elif key.vk == libtcod.KEY_KP5:
 			player.player_stats.breathe(1)
-			player.fighter.tick()
 			pass  #do nothing ie wait for the monster to come to you
 		else:
 			#test for other keys
@@ -1460,8 +1834,8 @@ def handle_keys():
 
 			if key_char == 'g':
 				#pick up an item
-				for object in objects:  #look for an item in the player's tile
-					if object.x == player.x and object.y == player.y and object.item:
+				for object in objects.at(player.x, player.y):  #look for an item in the player's tile
+					if object.item:
 						object.item.pick_up()
 						break
 
@@ -1484,11 +1858,20 @@ def handle_keys():
 					   '\nExperience to level up: ' + str(level_up_xp) + '\n\nMaximum HP: ' + str(player.fighter.max_hp) +
 					   '\nAttack: ' + str(player.fighter.power) + '\nDefense: ' + str(player.fighter.defense), CHARACTER_SCREEN_WIDTH)
 
+			if key_char == 'm':
+				#scroll back through the messages of the game
+				message_history()
+
 			if key_char == '<':
 				#go down stairs, if the player is on them
 				if stairs.x == player.x and stairs.y == player.y:
 					next_level()
 
+			if key_char == '>':
+				#go back up, if the player is on the stairs up
+				if upstairs and upstairs.x == player.x and upstairs.y == player.y:
+					previous_level()
+
 			if key_char == 'r':
 				#start resting until health/energy are full
 				rest()
@@ -1499,21 +1882,13 @@ def handle_keys():
 			if key_char == '`':
 				choice = text_input()
 				if choice == 'reveal map':
-					global map
-					for x in range(0, MAP_WIDTH):
-						for y in range(0, MAP_HEIGHT):
-							map[x][y].explored = True
-					global fov_recompute
-					fov_recompute = True
+					map.fill('explored', True)
+					map_redraw = True
 					message('Revealing the current map\'s tiles.')
 				
 				elif choice == 'unreveal map':
-					global map
-					for x in range(0, MAP_WIDTH):
-						for y in range(0, MAP_HEIGHT):
-							map[x][y].explored = False
-					global fov_recompute
-					fov_recompute = True
+					map.fill('explored', False)
+					map_redraw = True
 					message('Unexploring the current map\'s tiles.')
 				
 				elif choice == 'heal':
@@ -1549,32 +1924,16 @@ def handle_keys():
 
 			if key_char == '?':
 				msgbox('Use the arrow keys or numpad to move.\
-				\npress [i] to view your inventory.')
+				\npress [i] to view your inventory.\
+				\npress [m] to read the older messages.')
 			
 			return 'didnt-take-turn'
 
 def message(new_msg, color = libtcod.white, append = True, ):
-	#split the message if necessary, among multiple lines
-	new_msg_lines = textwrap.wrap(new_msg, MSG_WIDTH)
-
-	for line in new_msg_lines:
-		#if the buffer is full, remove the first line to make room for the new one
-		if len(game_msgs) == MSG_HEIGHT:
-			del game_msgs[0]
-
-		#add the new line as a tuple, with the text and the color
-		if append:
-			game_msgs.append( (line, color) )
-		else: #We want multiple messages on the same line, if possible.
-			if game_msgs:
-				new_msg = game_msgs.pop()
-				if color == libtcod.white and new_msg[1] is not color:
-					color = new_msg[1]
-				new_msg = new_msg[0]
-				
-				game_msgs.append( (new_msg + '  ' + line, color) )
-			else: #We have an empty list
-				game_msgs.append( (line, color) )
+	#add the message to the log (see message_log.py), it is split among
+	#multiple lines when it's shown. with append=False we want multiple
+	#messages on the same line, if possible.
+	game_msgs.add(new_msg, color, append)
 
 def check_level_up():
 	#see if the player's experience is enough to level-up
@@ -1594,11 +1953,11 @@ def check_level_up():
 						   'Intelligence (+1 intelligence, from ' + str(player.player_stats.intelligence) + ')'], LEVEL_SCREEN_WIDTH)
 
 		if choice == 0:
-			player.player_stats.strength += 1
+			player.player_stats.adjust_strength(1)
 		elif choice == 1:
-			player.player_stats.agility += 1
+			player.player_stats.adjust_agility(1)
 		elif choice == 2:
-			player.player_stats.intelligence += 1
+			player.player_stats.adjust_intelligence(1)
 
 
 
@@ -1620,7 +1979,10 @@ def monster_death(monster):
 	monster.color = libtcod.dark_red
 	monster.blocks = False
 	monster.fighter = None
+	if monster.ai:
+		monster.ai.free_path()  #corpses don't need their path any more
 	monster.ai = None
+	scheduler.remove(monster)  #corpses don't take turns
 	monster.name = 'remains of ' + monster.name
 	monster.send_to_back()
 
@@ -1646,12 +2008,12 @@ def target_tile(max_range=None):
 			return (None, None)  #cancel if the player right-clicked or pressed Escape
 
 		#accept the target if the player clicked in FOV, and in case a range is specified, if it's in that range
-		if (mouse.lbutton_pressed and libtcod.map_is_in_fov(fov_map, x, y) and
+		if (mouse.lbutton_pressed and is_visible(x, y) and
 				(max_range is None or player.distance(x, y) <= max_range)):
 			return (x, y)
 
 		if (key.vk in (libtcod.KEY_ENTER, libtcod.KEY_KPENTER) and
-			libtcod.map_is_in_fov(fov_map, target_x, target_y) and
+			is_visible(target_x, target_y) and
 				(max_range is None or
 				player.distance(target_x, target_y) <= max_range)):
 			return (target_x, target_y)
@@ -1702,8 +2064,8 @@ def target_monster(max_range=None):
 			return None
 
 		#return the first clicked monster, otherwise continue looping
-		for obj in objects:
-			if obj.x == x and obj.y == y and obj.fighter and obj != player:
+		for obj in objects.at(x, y):
+			if obj.fighter and obj != player:
 				return obj
 
 def closest_monster(max_range):
@@ -1712,7 +2074,7 @@ def closest_monster(max_range):
 	closest_dist = max_range + 1  #start with (slightly more than) maximum range
 
 	for object in objects:
-		if object.fighter and not object == player and libtcod.map_is_in_fov(fov_map, object.x, object.y):
+		if object.fighter and not object == player and is_visible(object.x, object.y):
 			#calculate distance between this object and the player
 			dist = player.distance_to(object)
 			if dist < closest_dist:  #it's closer, so remember it
@@ -1777,6 +2139,7 @@ def cast_confuse():
 	old_ai = monster.ai
 	monster.ai = ConfusedMonster(old_ai)
 	monster.ai.owner = monster  #tell the new component who owns it
+	do_after(CONFUSE_NUM_TURNS, end_confusion, monster)
 	message('The eyes of the ' + monster.name + ' look vacant, as they start to stumble around!', libtcod.light_green)
 
 def from_dungeon_level(table):
@@ -1786,55 +2149,146 @@ def from_dungeon_level(table):
 			return value
 	return 0
 
+#writes autosaves on a worker thread
+autosaver = savefile.BackgroundWriter()
+
 def save_game():
-	#open a new empty shelve (possibly overwriting an old one) to write the game data
-	file = shelve.open('savegame', 'n')
-	file['map'] = map
-	file['objects'] = objects
-	file['player_index'] = objects.index(player)  #index of player in objects list
-	file['stairs_index'] = objects.index(stairs)  #same for the stairs
-	file['inventory'] = inventory
-	file['abilities'] = abilities
-	file['game_msgs'] = game_msgs
-	file['game_state'] = game_state
-	file['dungeon_level'] = dungeon_level
+	#write the game to SAVE_FILE (possibly overwriting an old one)
+	autosaver.wait()
+	savefile.write(SAVE_FILE, saved_values(), globals())
+	levels.remove_stale_files()  #the levels of the game saved before, if it was another one
+
+def autosave():
+	#copy the game now, and leave converting, compressing and writing it to
+	#a worker thread so the game doesn't stall
+	if autosaver.error is not None:
+		print 'WARN: autosave failed: ' + str(autosaver.error)
+		autosaver.error = None
+	autosaver.write(SAVE_FILE, saved_values(), globals())
+
+def saved_values():
+	#everything that goes in a save game
+	return {
+		'map': map,
+		'objects': objects,
+		'player': player,
+		'stairs': stairs,
+		'upstairs': upstairs,
+		'start': start,
+		'levels': levels,
+		'streams': streams,
+		'inventory': inventory,
+		'abilities': abilities,
+		'game_msgs': game_msgs,
+		'game_state': game_state,
+		'dungeon_level': dungeon_level,
+		'scheduler': scheduler,
+		}
+
+def find_shelve_class(module, name):
+	#shelve save games pickled the game's objects as old-style instances,
+	#which pickle makes by calling their class without arguments. the
+	#Slotted classes are made empty instead, their __setstate__ fills them in.
+	__import__(module)
+	cls = getattr(sys.modules[module], name)
+	if isinstance(cls, type) and issubclass(cls, Slotted):
+		return lambda *args: cls.__new__(cls)
+	return cls
+
+def load_shelve_value(file, key):
+	unpickler = cPickle.Unpickler(StringIO(file.dict[key]))
+	unpickler.find_global = find_shelve_class
+	return unpickler.load()
+
+def load_shelve_game():
+	#read a game saved in the old shelve format, converting it as needed
+	file = shelve.open('savegame', 'r')
+	game = dict((key, load_shelve_value(file, key)) for key in ('map', 'inventory', 'abilities', 'game_msgs', 'game_state', 'dungeon_level'))
+	if not isinstance(game['map'], TileGrid):  #saved before the map became a TileGrid
+		game['map'] = TileGrid.from_tiles(game['map'])
+	if 'level' in file:
+		(objects, game['scheduler']) = load_shelve_value(file, 'level')
+	else:  #saved before there was a scheduler
+		objects = load_shelve_value(file, 'objects')
+		game['scheduler'] = None
+	if not isinstance(objects, ObjectIndex):  #saved before objects were indexed
+		objects = ObjectIndex(objects)
+	game['objects'] = objects
+	game['player'] = objects[file['player_index']]
+	game['stairs'] = objects[file['stairs_index']]
 	file.close()
- 
+	return game
+
 def load_game():
-	#open the previously saved shelve and load the game data
-	global map, objects, player, stairs, inventory, game_msgs, game_state, dungeon_level, abilities
+	#load the game saved by save_game(), or an older shelve save game
+	global map, objects, player, stairs, upstairs, start, levels, streams, inventory, game_msgs, game_state, dungeon_level, abilities, scheduler
 
-	file = shelve.open('savegame', 'r')
-	map = file['map']
-	objects = file['objects']
-	player = objects[file['player_index']]  #get index of player in objects list and access it
-	stairs = objects[file['stairs_index']]  #same for the stairs
-	inventory = file['inventory']
-	abilities = file['abilities']
-	game_msgs = file['game_msgs']
-	game_state = file['game_state']
-	dungeon_level = file['dungeon_level']
-	file.close()
+	if os.path.exists(SAVE_FILE):
+		game = savefile.read(SAVE_FILE, globals())
+	else:
+		game = load_shelve_game()
+	map = game['map']
+	objects = game['objects']
+	player = game['player']
+	stairs = game['stairs']
+	upstairs = game.get('upstairs')  #saved before levels could be revisited: no way up
+	start = game.get('start', (player.x, player.y))
+	levels = game.get('levels') or LevelStore(LEVELS_DIR, LEVEL_CACHE_SIZE, '%08x' % new_seed())
+	inventory = game['inventory']
+	if not isinstance(inventory, Inventory):  #saved as a list
+		inventory = Inventory(inventory)
+	invalidate_equipment_bonuses()
+	abilities = game['abilities']
+	game_msgs = game['game_msgs']
+	if isinstance(game_msgs, list):  #saved as a list of (line, color)
+		game_msgs = MessageLog.from_lines(MSG_WIDTH, MSG_HEIGHT, game_msgs)
+	game_state = game['game_state']
+	dungeon_level = game['dungeon_level']
+	scheduler = game['scheduler']
+	if scheduler is None:
+		schedule_level()
+	start_regeneration()  #older saves healed on a turn count instead
+	schedule_confusion_ends()
+	streams = game.get('streams') or RandomStreams(new_seed())  #older saves had no seed
+	streams.reseed(scheduler.time)
 
 	initialize_fov()
+	pregenerate_level(dungeon_level + 1)
 	message('Welcome back '+ player.name + '!', libtcod.green)
 
-def new_game(player_name='John Doe',player_race='Human',player_title='Xenoarchelogist'):
-	global player, game_msgs, game_state, dungeon_level
+def load_config(filename='dungeons.conf'):
+	#read the monster and item definitions and compile them into templates
+	global config, templates
+	config = ConfigParser.ConfigParser()
+	config.read(filename)
+	templates = compile_templates(config, globals())
+	for error in templates.errors:
+		print 'WARN: ' + filename + ': ' + error
+
+def new_game(player_name='John Doe',player_race='Human',player_title='Xenoarchelogist', seed=None):
+	global player, game_msgs, game_state, dungeon_level, scheduler, levels, streams
+
+	#the same seed makes the same dungeon
+	streams = RandomStreams(seed if seed is not None else new_seed())
 
 	#make a new player character
 	new_player(player_name,player_race,player_title)
 
 	#generate map (at this point it's not drawn to the screen)
 	dungeon_level = 1
-	make_map()
+	scheduler = None  #the game time starts again
+	levels = LevelStore(LEVELS_DIR, LEVEL_CACHE_SIZE, '%08x' % new_seed())
+	level = generate_level(dungeon_level)
+	enter_level(level, level['start'])
 	initialize_fov()
+	pregenerate_level(dungeon_level + 1)
+	start_regeneration()
 
 	game_state = 'playing'
 
 
-	#create the list of game messages and their colors, starts empty
-	game_msgs = []
+	#create the log of game messages and their colors, starts empty
+	game_msgs = MessageLog(MSG_WIDTH, MSG_HEIGHT)
 
 	#a warm welcoming message!
 	message('Welcome '+ player.name + '!', libtcod.green)
@@ -1858,7 +2312,7 @@ def new_player(player_name,player_race,player_title):
 	player.player_stats.change_race(player_race)
 	player.player_stats.change_title(player_title)
 	
-	inventory = []
+	inventory = Inventory()
 	abilities = []
 
 	#Handle race bonuses
@@ -2021,22 +2475,141 @@ def next_level():
 	message('You take a moment to rest, and recover your strength.', libtcod.light_violet)
 	player.fighter.heal(player.fighter.max_hp / 2)  #heal the player by 50%
 
-	dungeon_level += 1
 	message('After a rare moment of peace, you descend deeper into the heart of the dungeon...', libtcod.red)
-	make_map()  #create a fresh new level!
+	change_level(dungeon_level + 1)
+
+def previous_level():
+	#climb back to the level above
+	message('You climb back up the stairs.', libtcod.light_violet)
+	change_level(dungeon_level - 1)
+
+def change_level(depth):
+	#leave the current level for the one at depth, which is made if the
+	#player has never been there
+	global map, objects, stairs, upstairs, dungeon_level
+	for object in objects:  #the old level is put away, so release its monsters' paths
+		if object.ai:
+			object.ai.free_path()
+	objects.remove(player)
+	levels.put(dungeon_level, current_level(), globals())
+
+	going_down = depth > dungeon_level
+	dungeon_level = depth
+	level = levels.get(depth, globals()) or take_pregenerated_level(depth) or generate_level(depth)
+	#arrive on the stairs the player took (new levels have the stairs up at their start)
+	if going_down:
+		enter_level(level, level['start'])
+	else:
+		enter_level(level, (level['stairs'].x, level['stairs'].y))
 	initialize_fov()
+	pregenerate_level(depth + 1)
+	autosave()
+
+def current_level():
+	#the current level, without the player, as stored in the LevelStore
+	return {'map': map, 'objects': objects, 'stairs': stairs, 'upstairs': upstairs, 'start': start}
+
+def enter_level(level, position):
+	#make level the current one, with the player at position
+	global map, objects, stairs, upstairs, start
+	map = level['map']
+	objects = level['objects']
+	stairs = level['stairs']
+	upstairs = level['upstairs']
+	start = level['start']
+	objects.insert(0, player)
+	objects.move(player, position[0], position[1])
+	schedule_level()
+
+#the random generator levels are made with, see generate_level()
+generation_rnd = 0
+
+def generate_level(depth):
+	#make a new level for the given depth, returning it like current_level().
+	#the level only depends on the game seed and the depth.
+	global dungeon_level, generation_rnd
+	dungeon_level = depth
+	generation_rnd = streams.level(depth)
+	make_map()  #create a fresh new level!
+	libtcod.random_delete(generation_rnd)
+	generation_rnd = 0
+	return current_level()
+
+#levels are made ahead of time in a worker process, while the player explores
+level_generator = None  #the multiprocessing pool, made on first use
+pregenerated_level = None  #(depth, AsyncResult) of the level being made
+
+def init_level_generator(settings):
+	#runs in the worker process: same map settings and templates as the game
+	globals().update(settings)
+	load_config()
+
+def generate_level_snapshot(depth, seed):
+	#runs in the worker process: the level as savefile values, so it can be
+	#sent back to the game
+	global streams
+	streams = RandomStreams(seed)
+	return savefile.snapshot(generate_level(depth), globals())
+
+def pregenerate_level(depth):
+	#start making the level at depth in the background, if it's needed
+	global level_generator, pregenerated_level
+	pregenerated_level = None
+	if depth in levels:
+		return
+	if level_generator is None:
+		settings = {'MAP_WIDTH': MAP_WIDTH, 'MAP_HEIGHT': MAP_HEIGHT, 'MAX_ROOMS': MAX_ROOMS}
+		try:
+			level_generator = multiprocessing.Pool(1, init_level_generator, (settings,))
+		except (OSError, ImportError) as e:  #no worker processes here, levels are made when needed
+			print 'WARN: no level generator process: ' + str(e)
+			level_generator = False
+	if level_generator:
+		pregenerated_level = (depth, level_generator.apply_async(generate_level_snapshot, (depth, streams.seed)))
+
+def take_pregenerated_level(depth):
+	#returns the level made in the background for depth (waiting for it if
+	#it isn't finished), or None
+	global pregenerated_level
+	if pregenerated_level is None or pregenerated_level[0] != depth:
+		return None
+	result = pregenerated_level[1]
+	pregenerated_level = None
+	try:
+		return savefile.restore(result.get(), globals())
+	except Exception as e:  #anything that went wrong in the worker
+		print 'WARN: level generator failed: ' + str(e)
+		return None
  
 def initialize_fov():
 	global fov_recompute, fov_map
 	fov_recompute = True
 
 	#create the FOV map, according to the generated map
-	fov_map = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-	for y in range(MAP_HEIGHT):
-		for x in range(MAP_WIDTH):
-			libtcod.map_set_properties(fov_map, x, y, not map[x][y].block_sight, not map[x][y].blocked)
+	fov_map = libtcod.map_new(map.width, map.height)
+	load_fov_map(fov_map)
 
 	libtcod.console_clear(con)  #unexplored areas start black (which is the default background color)
+
+def load_fov_map(fov_map):
+	#copy the whole map into a libtcod map. libtcod 1.5.1 can't load a map
+	#from arrays, so this is as close to a bulk copy as it gets: most tiles
+	#are solid rock, the map is cleared to rock in one call and only the
+	#other tiles (the rooms and corridors) are set one by one.
+	libtcod.map_clear(fov_map, False, False)
+	for (x, y, transparent, walkable) in map.open_cells():
+		libtcod.map_set_properties(fov_map, x, y, transparent, walkable)
+
+def set_tile(x, y, blocked, block_sight=None):
+	#change one tile of the current level (digging, doors...), updating only
+	#that cell of the FOV map instead of rebuilding it
+	global fov_recompute
+	if block_sight is None: block_sight = blocked
+	map.set('blocked', x, y, blocked)
+	map.set('block_sight', x, y, block_sight)
+	libtcod.map_set_properties(fov_map, x, y, not block_sight, not blocked)
+	invalidate_player_field()  #monsters may have a new way to the player
+	fov_recompute = True
  
 def play_game():
 	global camera_x, camera_y, key, mouse
@@ -2047,31 +2620,92 @@ def play_game():
 	key = libtcod.Key()
 
 	(camera_x, camera_y) = (0, 0)
+	next_autosave = scheduler.time + AUTOSAVE_TURNS * TURN_LENGTH
 
 	while not libtcod.console_is_window_closed():
+		if profiler: profiler.start_frame()
+
 		#render the screen
 		libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS|libtcod.EVENT_MOUSE,key,mouse)
+		if profiler: profiler.mark('events')
 		render_all()
 
 		libtcod.console_flush()
-
-		#erase all objects at their old locations, before they move
-		for object in objects:
-			object.clear()
+		if profiler: profiler.mark('flush')
 
 		check_level_up()
 	
 		#handle keys and exit game if needed
 		player_action = handle_keys()
+		if profiler: profiler.mark('keys')
 		if player_action == 'exit':
 			save_game()
 			break
 
 		#let monsters take their turn
 		if game_state == 'playing' and player_action != 'didnt-take-turn':
-			for object in objects:
-				if object.ai:
-					object.ai.take_turn()
+			take_monster_turns()
+
+			if scheduler.time >= next_autosave:
+				autosave()
+				next_autosave = scheduler.time + AUTOSAVE_TURNS * TURN_LENGTH
+		if profiler:
+			profiler.mark('monsters')
+			profiler.end_frame()
+
+	if profiler:
+		profiler.dump(PROFILE_FILE)
+
+#the TurnScheduler of the current level, see schedule_level()
+scheduler = None
+
+#the RandomStreams of the game (see rng.py), made by new_game()
+streams = None
+
+#the FrameProfiler timing the phases of each frame, when the game runs with
+#--profile (see init()). None otherwise.
+profiler = None
+#the phases of a frame, in the order play_game() and render_all() go through them
+FRAME_PHASES = ('events', 'fov', 'map', 'objects', 'panel', 'log', 'flush', 'keys', 'monsters')
+
+def take_monster_turns():
+	#the player has spent a turn. everyone whose turn comes before the
+	#player's next one acts now, in order of time
+	scheduler.add(player, turn_length(player.fighter.speed))
+	if scheduler.wake_check_due(WAKE_CHECK_INTERVAL):
+		wake_nearby_monsters()
+
+	while game_state == 'playing':
+		actor = scheduler.pop()
+		if actor is player or actor is None:
+			break
+		actor.ai.take_turn()
+		if actor.ai:
+			schedule_actor(actor)
+
+def schedule_level():
+	#queue the monsters of the current level. the game time and the pending
+	#timed events go on from the previous level.
+	global scheduler
+	if scheduler is None:
+		scheduler = TurnScheduler()
+	scheduler.clear_actors()
+	for object in objects:
+		if object.ai:
+			schedule_actor(object)
+
+def schedule_actor(monster):
+	#queue the monster's next turn, or let it sleep if the player is far away
+	if monster.distance_to(player) > ACTIVE_RADIUS:
+		scheduler.sleep(monster)
+	else:
+		scheduler.add(monster, turn_length(monster.fighter.speed))
+
+def wake_nearby_monsters():
+	#sleeping monsters the player came close to join the queue again
+	for monster in list(scheduler.sleeping):
+		if monster.distance_to(player) <= ACTIVE_RADIUS:
+			scheduler.wake(monster, turn_length(monster.fighter.speed))
 
 def main_menu():
 	#libtcod.console_flush()
@@ -2149,16 +2783,33 @@ def name_menu():
 	choice = text_input()
 	return choice
 
-if __name__ == '__main__':
-	#libtcod.console_set_custom_font('arial12x12.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
-	libtcod.console_set_custom_font('terminal8x12_gs_tc.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
-	libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'Calamity', False)
-	libtcod.sys_set_fps(LIMIT_FPS)
+def init(headless=False, keys=(), profile=False):
+	#open the window and create the consoles, then load the config.
+	#with headless=True no window is opened: drawing does nothing and key
+	#presses come from keys (see headless.py), so the game can be run as a
+	#library, e.g. init(headless=True); new_game(); take_monster_turns()
+	#with profile=True the frames are timed (see profiler.py).
+	global libtcod, con, panel, log, mouse, key, camera_x, camera_y, profiler
+	if headless:
+		libtcod = HeadlessBackend(keys)
+	else:
+		#libtcod.console_set_custom_font('arial12x12.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
+		libtcod.console_set_custom_font('terminal8x12_gs_tc.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
+		libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'Calamity', False)
+		libtcod.sys_set_fps(LIMIT_FPS)
 	con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)
 	panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
 	log = libtcod.console_new(LOG_WIDTH, LOG_HEIGHT)
+	panel_cache.clear()  #new consoles, everything has to be drawn
+	profiler = FrameProfiler(FRAME_PHASES) if profile else None
 
-	config = ConfigParser.ConfigParser()
-	config.read('dungeons.conf')
+	#play_game() sets these up too, but render_all() needs them before
+	mouse = libtcod.Mouse()
+	key = libtcod.Key()
+	(camera_x, camera_y) = (0, 0)
 
+	load_config()
+
+if __name__ == '__main__':
+	init(profile='--profile' in sys.argv[1:])
 	main_menu()
\ No newline at end of file
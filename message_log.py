@@ -0,0 +1,121 @@
+#!/usr/bin/python
+
+#The message log.
+#
+#MessageLog keeps the most recent messages as they were written (text and
+#colour) in a ring buffer that holds at least a screenful. Messages are only
+#wrapped to the log's width when they are shown, and only the ones that are
+#on screen; their lines are cached until the message changes. Messages that
+#drop out of the ring buffer go to the scroll-back history, which is kept
+#zlib-compressed in chunks, so a long game's log costs little memory.
+
+import textwrap
+import zlib
+from collections import deque
+
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+
+from libtcodpy import Color
+
+HISTORY_CHUNK = 200  #messages compressed together in the history
+
+class MessageLog(object):
+	def __init__(self, width, height):
+		self.width = width  #wrap width
+		self.height = height  #lines shown
+		#recent messages, oldest first: [text, (r, g, b), wrapped lines or None].
+		#every message takes at least one line, so height of them fill the log.
+		self.messages = deque()
+		self.history = []  #compressed chunks of older messages
+		self.pending = []  #older messages not compressed yet: (text, (r, g, b))
+		self.version = 0  #changes whenever the visible lines may have changed
+
+	def __len__(self):
+		return len(self.messages)
+
+	def add(self, text, color, append=True):
+		#add a message. with append=False it goes on the same line as the last
+		#message if there is one, keeping the last message's colour if the new
+		#one is plain white.
+		rgb = (color.r, color.g, color.b)
+		if not append and self.messages:
+			last = self.messages[-1]
+			last[0] = last[0] + '  ' + text
+			if rgb == (255, 255, 255):
+				rgb = last[1]
+			last[1] = rgb
+			last[2] = None  #wrap it again
+		else:
+			self.messages.append([text, rgb, None])
+			if len(self.messages) > self.height:
+				(old_text, old_rgb, lines) = self.messages.popleft()
+				self.pending.append((old_text, old_rgb))
+				if len(self.pending) >= HISTORY_CHUNK:
+					self.compress_pending()
+		self.version += 1
+
+	def compress_pending(self):
+		self.history.append(zlib.compress(pickle.dumps(self.pending, pickle.HIGHEST_PROTOCOL)))
+		self.pending = []
+
+	def wrapped(self, message):
+		if message[2] is None:
+			message[2] = textwrap.wrap(message[0], self.width) or ['']
+		return message[2]
+
+	def visible_lines(self):
+		#the last height lines of the log, oldest first, as (line, Color)
+		lines = []
+		for message in reversed(self.messages):
+			color = Color(*message[1])
+			for line in reversed(self.wrapped(message)):
+				lines.append((line, color))
+				if len(lines) == self.height:
+					lines.reverse()
+					return lines
+		lines.reverse()
+		return lines
+
+	def all_messages(self):
+		#every message of the game, oldest first, as (text, Color)
+		for chunk in self.history:
+			for (text, rgb) in pickle.loads(zlib.decompress(chunk)):
+				yield (text, Color(*rgb))
+		for (text, rgb) in self.pending:
+			yield (text, Color(*rgb))
+		for message in self.messages:
+			yield (message[0], Color(*message[1]))
+
+	def history_lines(self):
+		#every message of the game wrapped to the log's width, oldest first,
+		#as (line, Color), for the scroll-back view
+		lines = []
+		for (text, color) in self.all_messages():
+			for line in textwrap.wrap(text, self.width) or ['']:
+				lines.append((line, color))
+		return lines
+
+	def __getstate__(self):
+		#saved without the wrapped lines
+		return {'width': self.width, 'height': self.height,
+			'messages': [(text, rgb) for (text, rgb, lines) in self.messages],
+			'history': self.history, 'pending': self.pending}
+
+	def __setstate__(self, state):
+		self.width = state['width']
+		self.height = state['height']
+		self.messages = deque([text, tuple(rgb), None] for (text, rgb) in state['messages'])
+		self.history = list(state['history'])
+		self.pending = [(text, tuple(rgb)) for (text, rgb) in state['pending']]
+		self.version = 0
+
+	@classmethod
+	def from_lines(cls, width, height, lines):
+		#a log holding the (line, Color) list of older save games
+		log = cls(width, height)
+		for (line, color) in lines:
+			log.add(line, color)
+		return log
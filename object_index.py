@@ -0,0 +1,47 @@
+#!/usr/bin/python
+
+#Spatial index for the objects of one level.
+#
+#ObjectIndex is a KeyedList of the objects by tile, so drawing order is
+#unchanged and tile lookups don't have to scan the whole level. Objects that
+#are on the map must be moved with move() so the index stays in sync.
+
+from keyed_list import KeyedList
+
+class ObjectIndex(KeyedList):
+	#the objects of one level, in drawing order (first is drawn first, at the
+	#back), indexed by tile.
+	def key(self, obj):
+		return (obj.x, obj.y)
+
+	#keeping the index in sync
+	def move(self, obj, x, y):
+		#put obj on tile (x, y). objects that are not on this level just get
+		#their coordinates updated.
+		if self._remove_from_group(obj, (obj.x, obj.y)):
+			obj.x = x
+			obj.y = y
+			self._add_to_group(obj)
+		else:
+			obj.x = x
+			obj.y = y
+
+	#tile queries
+	def at(self, x, y):
+		#returns the objects on tile (x, y). the sequence belongs to the index,
+		#so copy it before changing the level while looping over it.
+		return self.groups.get((x, y), ())
+
+	def blocking_at(self, x, y):
+		#returns the first object blocking tile (x, y), or None
+		for obj in self.groups.get((x, y), ()):
+			if obj.blocks:
+				return obj
+		return None
+
+	def fighter_at(self, x, y):
+		#returns the first object on tile (x, y) that can be attacked, or None
+		for obj in self.groups.get((x, y), ()):
+			if obj.fighter:
+				return obj
+		return None
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+#Frame timings.
+#
+#FrameProfiler measures where the time of each frame goes. The game loop
+#calls start_frame() at the top of a frame and mark(phase) at the end of each
+#phase (event polling, FOV, drawing, console_flush, keys, monster turns...),
+#which charges the time since the previous mark to that phase. The last
+#frames are kept in a ring buffer of floats, for the live overlay (see
+#overlay_text()), and every frame is counted in a histogram per phase, which
+#dump() writes to a text file. Run the game with --profile to turn it on.
+
+from array import array
+from bisect import bisect_right
+from timeit import default_timer as clock
+
+#upper edges of the histogram buckets, in milliseconds. 50ms is one frame at 20 fps.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+class FrameProfiler(object):
+	def __init__(self, phases, frames=200):
+		self.phases = tuple(phases) + ('frame',)  #'frame' is the whole frame
+		self.column = dict((phase, i) for (i, phase) in enumerate(self.phases))
+		self.width = len(self.phases)
+		self.frames = frames  #frames kept in the ring buffer
+		self.times = array('d', [0.0]) * (frames * self.width)  #seconds, a row per frame
+		self.row = 0  #start of the current frame's row
+		self.count = 0  #frames measured so far
+		self.counts = [[0] * (len(BUCKETS) + 1) for phase in self.phases]  #histograms
+		self.totals = [0.0] * self.width
+		self.slowest = [0.0] * self.width
+		self.started = self.last = clock()
+
+	def start_frame(self):
+		#begin a new row (it overwrites the oldest frame)
+		for i in range(self.row, self.row + self.width):
+			self.times[i] = 0.0
+		self.started = self.last = clock()
+
+	def mark(self, phase):
+		#the time since the previous mark was spent in phase
+		now = clock()
+		self.times[self.row + self.column[phase]] += now - self.last
+		self.last = now
+
+	def end_frame(self):
+		#count the frame in the histograms and move on in the ring buffer
+		row = self.row
+		self.times[row + self.width - 1] = self.last - self.started
+		for i in range(self.width):
+			seconds = self.times[row + i]
+			self.counts[i][bisect_right(BUCKETS, seconds * 1000)] += 1
+			self.totals[i] += seconds
+			if seconds > self.slowest[i]:
+				self.slowest[i] = seconds
+		self.count += 1
+		self.row = (row + self.width) % len(self.times)
+
+	def recent(self, phase):
+		#the times of phase in the frames of the ring buffer, in seconds
+		i = self.column[phase]
+		n = min(self.count, self.frames)
+		return [self.times[row * self.width + i] for row in range(n)]
+
+	def overlay_text(self):
+		#one line for the screen: the average frame of the recent frames and
+		#the phases that took most of it
+		if not self.count:
+			return ''
+		averages = []
+		for phase in self.phases[:-1]:
+			times = self.recent(phase)
+			averages.append((sum(times) / len(times), phase))
+		frame = sum(self.recent('frame')) / min(self.count, self.frames)
+		averages.sort(reverse=True)
+		slowest = ' '.join(phase + ' ' + milliseconds(seconds) for (seconds, phase) in averages[:3])
+		return 'frame ' + milliseconds(frame) + ' | ' + slowest
+
+	def report(self):
+		#the histograms of all the frames so far, as lines of text
+		lines = [str(self.count) + ' frames, times in milliseconds', '']
+		edges = ['<' + str(edge) for edge in BUCKETS] + ['>=' + str(BUCKETS[-1])]
+		lines.append('%-10s %8s %8s ' % ('phase', 'mean', 'max') + ' '.join('%6s' % edge for edge in edges))
+		for (i, phase) in enumerate(self.phases):
+			mean = self.totals[i] / self.count if self.count else 0.0
+			lines.append('%-10s %8.2f %8.2f ' % (phase, mean * 1000, self.slowest[i] * 1000) +
+				' '.join('%6d' % n for n in self.counts[i]))
+		return lines
+
+	def dump(self, filename):
+		f = open(filename, 'w')
+		try:
+			f.write('\n'.join(self.report()) + '\n')
+		finally:
+			f.close()
+
+def milliseconds(seconds):
+	return '%.1fms' % (seconds * 1000)
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+
+#Seeded random number streams.
+#
+#Every game has a seed. Each part of the game draws from its own libtcod
+#generator, seeded from the game seed and the stream's name, so that for
+#example a fight doesn't change what the next level looks like. Levels are
+#made with a generator of their own per depth: the same seed always makes
+#the same level, whether in the game or in the level generator process.
+
+import random
+import zlib
+
+import libtcodpy
+
+#stream names
+COMBAT = 'combat'
+AI = 'ai'
+GENERATION = 'generation'
+
+def new_seed():
+	#a seed for a new game
+	return random.randint(1, 0xffffffff)
+
+def stream_seed(seed, name, *salt):
+	#the seed of a stream, the same in every process and on every platform
+	key = ':'.join(str(part) for part in (seed, name) + salt)
+	return zlib.crc32(key) & 0xffffffff
+
+class RandomStreams(object):
+	#the random streams of one game
+	def __init__(self, seed):
+		self.seed = seed
+		self.salt = ()  #mixed into the stream seeds after loading, see reseed()
+		self.streams = {}  #name -> libtcod generator, made on first use
+
+	def get(self, name):
+		#the generator of a named stream, for libtcod.random_get_int() & co
+		rnd = self.streams.get(name)
+		if rnd is None:
+			rnd = libtcodpy.random_new_from_seed(stream_seed(self.seed, name, *self.salt))
+			self.streams[name] = rnd
+		return rnd
+
+	def level(self, depth):
+		#a new generator for making the level at depth. give it to
+		#libtcod.random_delete() when the level is done.
+		return libtcodpy.random_new_from_seed(stream_seed(self.seed, GENERATION, depth))
+
+	def reseed(self, *salt):
+		#libtcod generators can't be saved, so after loading a game the
+		#streams start again from the game seed mixed with salt (the game time)
+		for rnd in self.streams.values():
+			libtcodpy.random_delete(rnd)
+		self.streams = {}
+		self.salt = salt
+
+	def __getstate__(self):
+		return {'seed': self.seed, 'salt': self.salt}
+
+	def __setstate__(self, state):
+		self.seed = state['seed']
+		self.salt = tuple(state['salt'])
+		self.streams = {}
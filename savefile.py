@@ -0,0 +1,326 @@
+#!/usr/bin/python
+
+#Binary save file format.
+#
+#A save file is a short header followed by the (optionally compressed) game
+#state:
+#
+#	magic        8 bytes  'CALAMITY'
+#	version      uint16   SAVE_VERSION of the game that wrote it
+#	compression  uint8    NONE, ZLIB or LZMA
+#	length       uint32   size of the uncompressed body
+#	checksum     uint32   crc32 of the uncompressed body
+#	body
+#
+#The body only holds plain values (numbers, strings, lists...). Game objects
+#become records: their class name and their fields, or what __getstate__
+#returns (that's how the map layers end up as packed bits, see tile_grid.py).
+#Functions and classes are stored by name and looked up again in a namespace
+#when loading, so changing a class doesn't break old saves; when the layout
+#of the saved data changes, bump SAVE_VERSION and register a migration that
+#upgrades the older data.
+#
+#BackgroundWriter saves while the game goes on: the game is copied with a
+#plain pickle (fast, and the copy shares nothing with the running game), and
+#a worker thread turns the copy into the save format, compresses and writes
+#it. Files are written to a temporary file and renamed over the old save, so
+#a crash never leaves a half-written save game.
+
+import os
+import struct
+import threading
+import types
+import zlib
+
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+
+try:  #lzma is only in the standard library from Python 3.3 on
+	import lzma
+except ImportError:
+	lzma = None
+
+from libtcodpy import Color
+
+MAGIC = b'CALAMITY'
+SAVE_VERSION = 1
+HEADER = struct.Struct('<8sHBII')
+
+#compression methods
+NONE = 0
+ZLIB = 1
+LZMA = 2
+
+class SaveError(Exception):
+	#the file is not a save game, is damaged, or can't be read by this version
+	pass
+
+#migrations: version -> function(body) returning the body of version + 1
+MIGRATIONS = {}
+
+def migration(version):
+	#decorator registering a function that upgrades a body saved with the
+	#given version to the next one. the body is the decoded dict of plain
+	#values: {'state': ..., 'records': [(class name, fields), ...]}
+	def register(function):
+		MIGRATIONS[version] = function
+		return function
+	return register
+
+def default_compression():
+	return LZMA if lzma is not None else ZLIB
+
+def snapshot(state, namespace):
+	#turn a dict of game values into plain values, ready for write_snapshot().
+	#namespace maps names to the classes and functions that may appear in it
+	#(usually the game's globals()).
+	encoder = _Encoder(namespace)
+	return {'state': encoder.encode(state), 'records': encoder.records}
+
+def write_snapshot(filename, body, compression=None):
+	#write a snapshot to filename, replacing it atomically
+	if compression is None:
+		compression = default_compression()
+	data = pickle.dumps(body, pickle.HIGHEST_PROTOCOL)
+	header = HEADER.pack(MAGIC, SAVE_VERSION, compression, len(data), zlib.crc32(data) & 0xffffffff)
+
+	if compression == ZLIB:
+		data = zlib.compress(data, 6)
+	elif compression == LZMA:
+		if lzma is None:
+			raise SaveError('lzma compression is not available')
+		data = lzma.compress(data)
+	elif compression != NONE:
+		raise SaveError('unknown compression ' + str(compression))
+
+	temp = filename + '.tmp'
+	with open(temp, 'wb') as file:
+		file.write(header)
+		file.write(data)
+		file.flush()
+		os.fsync(file.fileno())
+	if os.name == 'nt' and os.path.exists(filename):
+		os.remove(filename)  #rename doesn't replace files on Windows
+	os.rename(temp, filename)
+
+def write(filename, state, namespace, compression=None):
+	#save a dict of game values, see snapshot()
+	write_snapshot(filename, snapshot(state, namespace), compression)
+
+class BackgroundWriter(object):
+	#saves on a worker thread, one save at a time
+	def __init__(self):
+		self.thread = None
+		self.error = None  #the exception of the last failed save, if any
+
+	def write(self, filename, state, namespace, compression=None):
+		#copy the game values now and save them in the background, like
+		#write(). waits for the previous save to finish first.
+		self.wait()
+		copy = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+		self.thread = threading.Thread(target=self._run, args=(filename, copy, namespace, compression))
+		self.thread.start()
+
+	def _run(self, filename, copy, namespace, compression):
+		try:
+			write(filename, pickle.loads(copy), namespace, compression)
+		except Exception as e:  #reported by the game, the worker just stops
+			self.error = e
+
+	def wait(self):
+		#block until the current write (if any) is done
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+def read(filename, namespace):
+	#load the dict of game values saved by write()
+	with open(filename, 'rb') as file:
+		header = file.read(HEADER.size)
+		data = file.read()
+	if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+		raise SaveError(filename + ' is not a save game')
+	(magic, version, compression, length, checksum) = HEADER.unpack(header)
+	if version > SAVE_VERSION:
+		raise SaveError(filename + ' was saved by a newer version of the game')
+
+	if compression == ZLIB:
+		data = zlib.decompress(data)
+	elif compression == LZMA:
+		if lzma is None:
+			raise SaveError(filename + ' is lzma compressed, which is not available')
+		data = lzma.decompress(data)
+	elif compression != NONE:
+		raise SaveError(filename + ' uses an unknown compression')
+	if len(data) != length or zlib.crc32(data) & 0xffffffff != checksum:
+		raise SaveError(filename + ' is damaged')
+
+	body = pickle.loads(data)
+	while version < SAVE_VERSION:
+		if version not in MIGRATIONS:
+			raise SaveError('no migration from save version ' + str(version))
+		body = MIGRATIONS[version](body)
+		version += 1
+	return restore(body, namespace)
+
+def restore(body, namespace):
+	#turn a snapshot() back into game values
+	return _Decoder(namespace, body['records']).decode(body['state'])
+
+#values are encoded as plain values (None, numbers, strings) or tagged tuples:
+#	('l', [...]) list         ('t', [...]) tuple       ('d', [(k, v), ...]) dict
+#	('s', [...]) set          ('f', [...]) frozenset   ('c', r, g, b) Color
+#	('r', n) record n         ('F', name) function     ('C', name) class
+PLAIN = (type(None), bool, int, long, float, str, unicode)
+CLASSES = (type, types.ClassType)  #new and old-style classes
+
+def _fields(obj):
+	#the saved fields of an object, like pickle would take them
+	if hasattr(obj, '__getstate__'):
+		return obj.__getstate__()
+	fields = dict(getattr(obj, '__dict__', {}))
+	for cls in getattr(obj.__class__, '__mro__', ()):
+		for slot in cls.__dict__.get('__slots__', ()):
+			if hasattr(obj, slot):
+				fields[slot] = getattr(obj, slot)
+	return fields
+
+class _Encoder(object):
+	def __init__(self, namespace):
+		self.namespace = namespace
+		self.records = []  #(class name, encoded fields)
+		self.record_ids = {}  #id(object) -> record number
+		self.keep = []  #objects recorded, so their ids stay unique
+
+	def name_of(self, value):
+		name = getattr(value, '__name__', None)
+		if name is None or self.namespace.get(name) is not value:
+			raise SaveError("can't save " + repr(value) + ', it is not in the namespace')
+		return name
+
+	def encode(self, value):
+		if isinstance(value, PLAIN):
+			return value
+		if isinstance(value, list):
+			return ('l', [self.encode(v) for v in value])
+		if isinstance(value, tuple):
+			return ('t', [self.encode(v) for v in value])
+		if isinstance(value, dict):
+			return ('d', [(self.encode(k), self.encode(v)) for (k, v) in value.items()])
+		if isinstance(value, set):
+			return ('s', [self.encode(v) for v in value])
+		if isinstance(value, frozenset):
+			return ('f', [self.encode(v) for v in value])
+		if isinstance(value, Color):
+			return ('c', value.r, value.g, value.b)
+		if isinstance(value, (types.FunctionType, types.BuiltinFunctionType)):
+			return ('F', self.name_of(value))
+		if isinstance(value, CLASSES):
+			return ('C', self.name_of(value))
+		return ('r', self.record(value))
+
+	def record(self, obj):
+		#returns the record number of obj, recording it the first time
+		n = self.record_ids.get(id(obj))
+		if n is None:
+			n = len(self.records)
+			self.record_ids[id(obj)] = n
+			self.keep.append(obj)
+			self.records.append(None)  #reserve the slot, fields may refer back to obj
+			self.records[n] = (self.name_of(obj.__class__), self.encode(_fields(obj)))
+		return n
+
+def _references(value):
+	#yields the record numbers an encoded value refers to
+	if not isinstance(value, tuple):
+		return
+	tag = value[0]
+	if tag == 'r':
+		yield value[1]
+	elif tag in ('l', 't', 's', 'f'):
+		for v in value[1]:
+			for n in _references(v):
+				yield n
+	elif tag == 'd':
+		for (k, v) in value[1]:
+			for n in _references(k):
+				yield n
+			for n in _references(v):
+				yield n
+
+class _Empty:
+	pass
+
+class _Decoder(object):
+	def __init__(self, namespace, records):
+		self.namespace = namespace
+		self.records = records
+		self.objects = []
+		#first make every object empty, so that references can be resolved...
+		for (class_name, fields) in records:
+			cls = self.lookup(class_name)
+			if isinstance(cls, type):
+				obj = cls.__new__(cls)
+			else:  #old-style class
+				obj = _Empty()
+				obj.__class__ = cls
+			self.objects.append(obj)
+		#...then fill them in. objects with __setstate__ come last, each one
+		#after the objects it refers to, which it may look at (an index of
+		#objects needs their positions).
+		later = {}  #record number -> fields, of the objects with __setstate__
+		for (n, (obj, (class_name, fields))) in enumerate(zip(self.objects, records)):
+			if hasattr(obj, '__setstate__'):
+				later[n] = fields
+			else:
+				for (name, value) in self.decode(fields).items():
+					setattr(obj, name, value)
+		for n in range(len(records)):
+			if n in later:
+				self.set_up(n, later)
+
+	def set_up(self, first, later):
+		#call __setstate__ of record first and of the records of later it
+		#refers to, depth first so the referred ones come before. records
+		#referring to each other in a loop are set up in the order they're met.
+		fields = later.pop(first)
+		stack = [(first, fields, _references(fields))]
+		while stack:
+			(n, fields, references) = stack[-1]
+			for m in references:
+				if m in later:
+					fields = later.pop(m)
+					stack.append((m, fields, _references(fields)))
+					break
+			else:
+				stack.pop()
+				self.objects[n].__setstate__(self.decode(fields))
+
+	def lookup(self, name):
+		if name not in self.namespace:
+			raise SaveError('unknown class or function ' + name + ' in save game')
+		return self.namespace[name]
+
+	def decode(self, value):
+		if not isinstance(value, tuple):
+			return value
+		tag = value[0]
+		if tag == 'r':
+			return self.objects[value[1]]
+		if tag == 'l':
+			return [self.decode(v) for v in value[1]]
+		if tag == 't':
+			return tuple(self.decode(v) for v in value[1])
+		if tag == 'd':
+			return dict((self.decode(k), self.decode(v)) for (k, v) in value[1])
+		if tag == 's':
+			return set(self.decode(v) for v in value[1])
+		if tag == 'f':
+			return frozenset(self.decode(v) for v in value[1])
+		if tag == 'c':
+			return Color(value[1], value[2], value[3])
+		if tag in ('F', 'C'):
+			return self.lookup(value[1])
+		raise SaveError('damaged save game: unknown tag ' + repr(tag))
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+#Turn scheduler: who acts next, and when.
+#
+#Only actors (the player and monsters with an AI) are kept, in a heap ordered
+#by the game time of their next turn. Faster actors get shorter delays, so
+#they come up more often. Actors far from the action can be put to sleep:
+#they leave the heap and cost nothing until they are woken up again.
+#Timed events (call_later) sit in a second heap on the same clock and are
+#fired in order as the game time passes them.
+#The scheduler's clock is the game time; it only moves forward in pop().
+
+import heapq
+
+NORMAL_SPEED = 100  #speed of the player and of most monsters
+TURN_LENGTH = 100  #game time a turn takes at normal speed
+
+def turn_length(speed):
+	#game time between two turns of an actor with the given speed
+	return max(1, TURN_LENGTH * NORMAL_SPEED // max(1, speed))
+
+class TurnScheduler(object):
+	def __init__(self, time=0):
+		self.time = time  #current game time
+		self.queue = []  #heap of [time, order, actor] entries
+		self.entries = {}  #actor -> its entry in the queue
+		self.sleeping = set()  #actors that are out of the queue until woken
+		self.events = []  #heap of [time, order, function, args] entries
+		self.order = 0  #breaks ties, so equal times keep the order things were added in
+		self.next_wake_check = time
+
+	def __getstate__(self):
+		#a queue entry is the same list in the heap and in entries. saving
+		#would copy them apart, so only the live turns are saved and the shared
+		#lists are made again when loading.
+		state = self.__dict__.copy()
+		del state['entries']
+		state['queue'] = [tuple(entry) for entry in self.queue if entry[2] is not None]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		#older saves have entries too, and may have removed turns in the queue
+		self.queue = [list(entry) for entry in state['queue'] if entry[2] is not None]
+		heapq.heapify(self.queue)
+		self.entries = dict((entry[2], entry) for entry in self.queue)
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, actor):
+		return actor in self.entries
+
+	def actors(self):
+		#every actor of the level, queued or sleeping
+		return list(self.entries) + list(self.sleeping)
+
+	def add(self, actor, delay=0):
+		#schedule the actor's next turn delay time units from now, replacing
+		#any turn it already had
+		self.remove(actor)
+		entry = [self.time + delay, self.order, actor]
+		self.order += 1
+		self.entries[actor] = entry
+		heapq.heappush(self.queue, entry)
+
+	def remove(self, actor):
+		#forget the actor (dead, left the level...). its heap entry is only
+		#marked, and thrown away when it reaches the top.
+		entry = self.entries.pop(actor, None)
+		if entry is not None:
+			entry[2] = None
+		self.sleeping.discard(actor)
+
+	def clear_actors(self):
+		#forget every actor (a new level), keeping the clock and the events
+		self.queue = []
+		self.entries = {}
+		self.sleeping = set()
+
+	def pop(self):
+		#returns the actor whose turn comes first, moving the clock to that
+		#turn, or None if nobody is scheduled. events due until then are fired
+		#on the way. the actor has to be add()ed again to get another turn.
+		while self.queue:
+			(time, order, actor) = self.queue[0]
+			if self.events and self.events[0][0] <= time:
+				self.run_next_event()
+				continue
+			heapq.heappop(self.queue)
+			if actor is not None:
+				del self.entries[actor]
+				self.time = time
+				return actor
+		return None
+
+	def sleep(self, actor):
+		#take the actor out of the queue until wake() is called
+		self.remove(actor)
+		self.sleeping.add(actor)
+
+	def wake(self, actor, delay=0):
+		self.sleeping.discard(actor)
+		self.add(actor, delay)
+
+	def wake_check_due(self, interval):
+		#true at most once every interval time units while someone sleeps,
+		#so the sleepers are only looked at now and then
+		if not self.sleeping or self.time < self.next_wake_check:
+			return False
+		self.next_wake_check = self.time + interval
+		return True
+
+	#timed events
+	def call_at(self, time, function, *args):
+		#call function(*args) when the game time reaches time. function should
+		#be a module-level function, so that the event can be saved. returns
+		#the event, for cancel().
+		event = [max(time, self.time), self.order, function, args]
+		self.order += 1
+		heapq.heappush(self.events, event)
+		return event
+
+	def call_later(self, delay, function, *args):
+		#call function(*args) delay time units from now
+		return self.call_at(self.time + delay, function, *args)
+
+	def cancel(self, event):
+		#the event stays in the heap, but does nothing when its time comes
+		event[2] = None
+
+	def run_next_event(self):
+		#move the clock to the first event and fire it
+		(time, order, function, args) = heapq.heappop(self.events)
+		self.time = max(self.time, time)
+		if function is not None:
+			function(*args)
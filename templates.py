@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+#Monster and item templates compiled from dungeons.conf.
+#
+#The config is read and checked once, when the game starts: every monster and
+#item section becomes an immutable MonsterTemplate or ItemTemplate with its
+#numbers parsed, its colour turned into an (r, g, b) tuple and its functions
+#and classes looked up. Spawning only has to build objects from a template.
+#Problems found on the way are collected in TemplateSet.errors, worded like
+#the messages of test_config.py.
+
+import json
+from collections import namedtuple, OrderedDict
+
+from helpers import WeightedChoice
+
+MonsterTemplate = namedtuple('MonsterTemplate', ['name', 'char', 'color', 'hp', 'defense', 'power', 'xp',
+	'evade', 'block', 'accuracy', 'speed', 'species', 'unique', 'ai_component', 'death_function', 'chance'])
+
+ItemTemplate = namedtuple('ItemTemplate', ['name', 'type', 'char', 'color', 'stackable', 'use_function',
+	'slot', 'bonuses', 'chance'])
+
+#config keys of equipment stats, and the Equipment argument each one fills
+EQUIPMENT_BONUS_KEYS = (('power', 'power_bonus'), ('accuracy', 'accuracy_bonus'), ('defense', 'defense_bonus'),
+	('evade', 'evade_bonus'), ('block', 'block_bonus'), ('max_hp', 'max_hp_bonus'), ('strength', 'strength_bonus'),
+	('agility', 'agility_bonus'), ('intelligence', 'intelligence_bonus'), ('oxygen', 'oxygen_bonus'))
+
+def chance_at(table, level):
+	#returns the value of a [[value, level], ...] table at a dungeon level.
+	#the table specifies what value occurs after each level, default is 0.
+	for (value, min_level) in reversed(table):
+		if level >= min_level:
+			return value
+	return 0
+
+class TemplateSet(object):
+	#all the templates of one config file
+	def __init__(self):
+		self.monsters = OrderedDict()  #name -> MonsterTemplate, in config order
+		self.items = OrderedDict()  #name -> ItemTemplate, in config order
+		self.errors = []  #messages about invalid entries
+		self._monster_chances = {}  #dungeon level -> chances, filled on demand
+		self._item_chances = {}
+		self._monster_choices = {}  #dungeon level -> WeightedChoice, filled on demand
+		self._item_choices = {}
+
+	def monster_chances(self, level):
+		#returns {monster name: chance} for a dungeon level, for random_choice()
+		if level not in self._monster_chances:
+			self._monster_chances[level] = OrderedDict(
+				(name, chance_at(template.chance, level)) for (name, template) in self.monsters.items())
+		return self._monster_chances[level]
+
+	def item_chances(self, level):
+		#returns {item name: chance} for a dungeon level, for random_choice()
+		if level not in self._item_chances:
+			self._item_chances[level] = OrderedDict(
+				(name, chance_at(template.chance, level)) for (name, template) in self.items.items())
+		return self._item_chances[level]
+
+	def monster_choice(self, level):
+		#returns a WeightedChoice of monster names for a dungeon level
+		if level not in self._monster_choices:
+			self._monster_choices[level] = WeightedChoice(self.monster_chances(level))
+		return self._monster_choices[level]
+
+	def item_choice(self, level):
+		#returns a WeightedChoice of item names for a dungeon level
+		if level not in self._item_choices:
+			self._item_choices[level] = WeightedChoice(self.item_chances(level))
+		return self._item_choices[level]
+
+class _Section(object):
+	#reads values of one config section, recording errors instead of raising
+	def __init__(self, templates, name, values):
+		self.templates = templates
+		self.name = name
+		self.values = values
+
+	def error(self, text):
+		self.templates.errors.append(self.name + ': ' + text)
+
+	def string(self, key, default=None):
+		if key in self.values:
+			return self.values[key]
+		if default is None:
+			self.error('"' + key + '" is not defined')
+		return default
+
+	def number(self, key, default=None):
+		value = self.string(key, default)
+		try:
+			return int(value)
+		except (TypeError, ValueError):
+			if value is not None:
+				self.error('"' + key + '" is not numeric')
+			return 0
+
+	def boolean(self, key, default='False'):
+		return self.string(key, default).strip().lower() in ('1', 'yes', 'true', 'on')
+
+	def color(self, key):
+		try:
+			color = tuple(json.loads(self.string(key, '[255, 255, 255]')))
+			if len(color) != 3:
+				raise ValueError('not three values')
+			return color
+		except (TypeError, ValueError):
+			self.error('"' + key + '" invalid')
+			return (255, 255, 255)
+
+	def chance(self):
+		try:
+			table = json.loads(self.string('chance', '[]'))
+			if not type(table) is list or len(table) == 0:
+				raise ValueError('empty list')
+			for entry in table:
+				if not type(entry) is list or len(entry) < 2:
+					raise ValueError('must be a list of lists')
+			return tuple((value, level) for (value, level) in table)
+		except (TypeError, ValueError) as e:
+			self.error('"chance" invalid - ' + str(e))
+			return ()
+
+	def lookup(self, key, namespace):
+		#returns the function or class named by the key, or None if it is blank
+		name = self.string(key, '')
+		if not name:
+			return None
+		if name not in namespace:
+			self.error('"' + name + '" not a valid function or class')
+			return None
+		return namespace[name]
+
+def compile_templates(config, namespace):
+	#turns the monster and item sections of a ConfigParser into templates.
+	#namespace maps the names used for ai_component, death_function and
+	#use_function to the actual classes and functions (usually globals()).
+	templates = TemplateSet()
+
+	for name in config.get('lists', 'monster list').split(', '):
+		if not config.has_section(name):
+			templates.errors.append(name + ': no such section')
+			continue
+		section = _Section(templates, name, dict(config.items(name)))
+		templates.monsters[name] = MonsterTemplate(
+			name=name,
+			char=section.string('char', '?'),
+			color=section.color('color'),
+			hp=section.number('hp'),
+			defense=section.number('defense'),
+			power=section.number('power'),
+			xp=section.number('xp'),
+			evade=section.number('evade', '10'),
+			block=section.number('block', '0'),
+			accuracy=section.number('accuracy', '12'),
+			speed=section.number('speed', '100'),
+			species=section.string('species', 'Humanoid'),
+			unique=section.boolean('unique'),
+			ai_component=section.lookup('ai_component', namespace),
+			death_function=section.lookup('death_function', namespace),
+			chance=section.chance())
+
+	for name in config.get('lists', 'item list').split(', '):
+		if not config.has_section(name):
+			templates.errors.append(name + ': no such section')
+			continue
+		section = _Section(templates, name, dict(config.items(name)))
+		item_type = section.string('type')
+		if item_type not in ('item', 'equipment'):
+			section.error('"type" must be item or equipment')
+
+		slot = None
+		bonuses = ()
+		if item_type == 'equipment':
+			slot = section.string('slot')
+			bonuses = tuple((argument, section.number(key, '0')) for (key, argument) in EQUIPMENT_BONUS_KEYS)
+
+		templates.items[name] = ItemTemplate(
+			name=name,
+			type=item_type,
+			char=section.string('char', '?'),
+			color=section.color('color'),
+			stackable=section.boolean('stackable'),
+			use_function=section.lookup('use_function', namespace),
+			slot=slot,
+			bonuses=bonuses,
+			chance=section.chance())
+
+	return templates
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+# Tests of the monster AI: chasing along the distance field, and the path
+# a monster keeps to go around the monsters in its way.
+#
+#   python -m unittest test_ai
+
+import unittest
+
+import main
+from tile_grid import TileGrid
+from object_index import ObjectIndex
+
+class PathCacheTest(unittest.TestCase):
+	def setUp(self):
+		main.init(headless=True)
+		main.new_game(seed=1)
+		#a room split by a wall at x=8, with a door at (8, 10) and a gap at the
+		#bottom. the player is west of the wall, a monster stands in the door
+		#and another one waits behind it.
+		main.map = TileGrid(main.MAP_WIDTH, main.MAP_HEIGHT)
+		main.map.carve(2, 2, 20, 20)
+		main.map.fill_rect('blocked', 8, 2, 9, 19, True)
+		main.map.fill_rect('block_sight', 8, 2, 9, 19, True)
+		main.map.set('blocked', 8, 10, False)
+		main.map.set('block_sight', 8, 10, False)
+		main.initialize_fov()
+		template = main.templates.monsters.values()[0]
+		self.door = main.spawn_monster(template, 8, 10)
+		self.behind = main.spawn_monster(template, 9, 10)
+		main.player.x, main.player.y = (4, 10)
+		main.objects = ObjectIndex([self.door, self.behind, main.player])
+		main.BasicMonster.path_stats.update(recomputed=0, cached=0)
+
+	def test_blocked_monster_goes_around(self):
+		self.behind.ai.take_turn()
+		self.assertEqual(main.BasicMonster.path_stats, {'recomputed': 1, 'cached': 0})
+		self.assertNotEqual((self.behind.x, self.behind.y), (9, 10))
+		self.assertTrue(self.behind.y > 10)  #towards the gap at the bottom
+
+	def test_path_is_reused_until_the_player_moves(self):
+		for turn in range(4):
+			self.behind.ai.take_turn()
+		self.assertEqual(main.BasicMonster.path_stats, {'recomputed': 1, 'cached': 3})
+
+		main.objects.move(main.player, 5, 10)
+		self.behind.ai.take_turn()
+		self.assertEqual(main.BasicMonster.path_stats['cached'], 3)
+
+	def test_free_monster_follows_the_field(self):
+		main.objects.remove(self.door)
+		self.behind.ai.take_turn()
+		self.assertEqual((self.behind.x, self.behind.y), (8, 10))
+		self.assertEqual(main.BasicMonster.path_stats, {'recomputed': 0, 'cached': 0})
+
+	def test_opened_wall_is_used(self):
+		main.get_player_field()
+		main.set_tile(8, 9, False)
+		self.assertTrue(main.libtcod.map_is_walkable(main.fov_map, 8, 9))
+		self.assertFalse(main.libtcod.map_is_walkable(main.fov_map, 8, 8))
+		#the field is computed again with the new opening, no path needed
+		self.behind.ai.take_turn()
+		self.assertEqual((self.behind.x, self.behind.y), (8, 9))
+		self.assertEqual(main.BasicMonster.path_stats, {'recomputed': 0, 'cached': 0})
+
+if __name__ == '__main__':
+	unittest.main()
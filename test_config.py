@@ -154,6 +154,8 @@ if __name__ == '__main__':
 		is_numeric(monster, 'defense')
 		is_numeric(monster, 'power')
 		is_numeric(monster, 'xp')
+		if 'speed' in monster:  # optional, 100 is normal speed
+			is_numeric(monster, 'speed')
 		has_attrib(dungeons, monster, 'death_function')
 		has_attrib(dungeons, monster, 'ai_component')
 
@@ -164,6 +166,13 @@ if __name__ == '__main__':
 		# TEST ITEM HERE
 		is_list_of_list(item, 'chance')
 
+	# the game compiles the config into templates at startup, check that too
+	print('* compiling templates...')
+	templates = dungeons.compile_templates(config, vars(dungeons))
+	for error in templates.errors:
+		has_errors = True
+		print(yellow + '\t\t' + error + reset)
+
 	if has_errors:
 		print(red + '\nUnit test failed :(' + reset)
 	else:
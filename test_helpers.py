@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+# Tests of the dice and the weighted random choices in helpers.py.
+#
+#   python -m unittest test_helpers
+
+import unittest
+
+import libtcodpy as libtcod
+import helpers
+from helpers import Dice, WeightedChoice, roll_dice, roll_ranges, BULK_RANGE
+
+def chi_square(counts, chances):
+	#how far the counts are from the chances (bigger is further)
+	total = sum(counts.values())
+	weight = float(sum(chances.values()))
+	return sum((counts.get(key, 0) - total * chance / weight) ** 2 / (total * chance / weight)
+		for (key, chance) in chances.items() if chance)
+
+class DiceTest(unittest.TestCase):
+	def test_parse(self):
+		for (expression, parsed) in (('2d6', (2, 6, 0)), ('3d4+2', (3, 4, 2)), ('d8-1', (1, 8, -1)), ('1 D 10', (1, 10, 0))):
+			dice = Dice(expression)
+			self.assertEqual((dice.count, dice.sides, dice.bonus), parsed)
+
+	def test_rolls_cover_the_range(self):
+		rnd = libtcod.random_new_from_seed(1)
+		dice = Dice('3d4+2')
+		rolls = [dice.roll(rnd) for i in range(2000)]
+		self.assertEqual(set(rolls), set(range(5, 15)))
+		self.assertAlmostEqual(sum(rolls) / 2000.0, 9.5, delta=0.2)
+
+	def test_roll_dice_parses_once(self):
+		roll_dice('4d3', libtcod.random_new_from_seed(1))
+		dice = helpers._parsed_dice['4d3']
+		roll_dice('4d3', libtcod.random_new_from_seed(1))
+		self.assertIs(helpers._parsed_dice['4d3'], dice)
+
+	def test_roll_ranges_bounds(self):
+		#more ranges than fit in one draw, and one bigger than a draw
+		ranges = [(0, 99)] * 5 + [(-3, 3), (7, 7), (0, BULK_RANGE * 4)]
+		rnd = libtcod.random_new_from_seed(2)
+		seen = [set() for r in ranges]
+		for i in range(500):
+			for (value, (low, high), values) in zip(roll_ranges(ranges, rnd), ranges, seen):
+				self.assertTrue(low <= value <= high)
+				values.add(value)
+		self.assertEqual(seen[5], set(range(-3, 4)))
+		self.assertTrue(len(seen[0]) > 90)
+
+	def test_same_seed_same_rolls(self):
+		dice = Dice('2d6')
+		(a, b, c) = [libtcod.random_new_from_seed(seed) for seed in (5, 5, 6)]
+		rolls = [[dice.roll(rnd) for i in range(50)] for rnd in (a, b, c)]
+		self.assertEqual(rolls[0], rolls[1])
+		self.assertNotEqual(rolls[0], rolls[2])
+
+class WeightedChoiceTest(unittest.TestCase):
+	def check_distribution(self, chances, draws=20000):
+		choice = WeightedChoice(chances)
+		rnd = libtcod.random_new_from_seed(3)
+		counts = {}
+		for i in range(draws):
+			key = choice.choose(rnd)
+			counts[key] = counts.get(key, 0) + 1
+		for (key, chance) in chances.items():
+			if not chance:
+				self.assertFalse(key in counts)
+		#well under the 0.1% threshold for up to 3 degrees of freedom
+		self.assertTrue(chi_square(counts, chances) < 16.3, counts)
+
+	def test_distribution(self):
+		self.check_distribution({'clown': 1, 'spider': 3, 'drill': 6, 'never': 0})
+
+	def test_distribution_of_big_chances(self):
+		#too many outcomes for a single draw
+		self.check_distribution({'a': BULK_RANGE, 'b': 2 * BULK_RANGE, 'c': BULK_RANGE // 2})
+
+	def test_single_key(self):
+		choice = WeightedChoice({'only': 5})
+		self.assertEqual(len(choice), 1)
+		self.assertEqual(choice.choose(libtcod.random_new_from_seed(1)), 'only')
+
+	def test_same_seed_same_choices(self):
+		choice = WeightedChoice({'a': 2, 'b': 5, 'c': 1})
+		(a, b, c) = [libtcod.random_new_from_seed(seed) for seed in (7, 7, 8)]
+		picks = [[choice.choose(rnd) for i in range(50)] for rnd in (a, b, c)]
+		self.assertEqual(picks[0], picks[1])
+		self.assertNotEqual(picks[0], picks[2])
+
+	def test_nothing_to_choose(self):
+		self.assertRaises(ValueError, WeightedChoice({'a': 0, 'b': 0}).choose)
+		self.assertRaises(ValueError, WeightedChoice({}).choose)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+# Tests of the store of visited levels.
+#
+#   python -m unittest test_level_store
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from level_store import LevelStore
+
+class LevelStoreTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.store = LevelStore(self.directory, capacity=1, game='game')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_old_levels_spill_to_disk(self):
+		self.store.put(1, {'depth': 1}, {})
+		self.store.put(2, {'depth': 2}, {})
+		self.assertEqual(os.listdir(self.directory), ['level-game-1.sav'])
+		self.assertEqual(self.store.get(1, {}), {'depth': 1})
+		self.assertEqual(self.store.get(2, {}), {'depth': 2})
+		self.assertEqual(os.listdir(self.directory), [])
+
+	def test_files_of_an_older_game_are_kept_until_saved_over(self):
+		#the save game still refers to the older game's files
+		older = LevelStore(self.directory, capacity=0, game='old')
+		older.put(3, {'depth': 3}, {})
+		legacy = os.path.join(self.directory, 'level-4.sav')  #saved before games had ids
+		open(legacy, 'wb').close()
+		other = os.path.join(self.directory, 'notes.txt')
+		open(other, 'wb').close()
+
+		store = LevelStore(self.directory, capacity=0, game='new')
+		store.put(3, {'depth': 'new 3'}, {})
+		self.assertEqual(older.get(3, {}), {'depth': 3})
+		older.put(3, {'depth': 3}, {})
+
+		#once the new game is saved, only its own files are left
+		store.remove_stale_files()
+		self.assertEqual(sorted(os.listdir(self.directory)), ['level-new-3.sav', 'notes.txt'])
+		self.assertEqual(store.get(3, {}), {'depth': 'new 3'})
+
+	def test_remove_stale_files_without_directory(self):
+		shutil.rmtree(self.directory)
+		self.store.remove_stale_files()
+		os.mkdir(self.directory)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+# Tests of the message log: the ring buffer of recent messages and the
+# compressed history behind it.
+#
+#   python -m unittest test_message_log
+
+import pickle
+import unittest
+
+from message_log import MessageLog, HISTORY_CHUNK
+from libtcodpy import Color
+
+WHITE = Color(255, 255, 255)
+RED = Color(255, 0, 0)
+
+def texts(messages):
+	return [text for (text, color) in messages]
+
+class MessageLogTest(unittest.TestCase):
+	def setUp(self):
+		self.log = MessageLog(20, 4)
+
+	def fill(self, n):
+		for i in range(n):
+			self.log.add('message ' + str(i), WHITE)
+
+	def test_ring_buffer_is_bounded(self):
+		self.fill(10)
+		self.assertEqual(len(self.log), 4)
+		self.assertEqual([text for (text, rgb, lines) in self.log.messages],
+			['message 6', 'message 7', 'message 8', 'message 9'])
+		self.assertEqual(texts(self.log.pending), ['message ' + str(i) for i in range(6)])
+
+	def test_history_is_compressed_in_chunks(self):
+		self.fill(4 + 2 * HISTORY_CHUNK + 3)
+		self.assertEqual(len(self.log.history), 2)
+		self.assertEqual(len(self.log.pending), 3)
+		self.assertEqual(texts(self.log.all_messages()), ['message ' + str(i) for i in range(4 + 2 * HISTORY_CHUNK + 3)])
+
+	def test_same_line(self):
+		self.log.add('You hit.', RED)
+		self.log.add('It blocks.', WHITE, append=False)
+		self.assertEqual(len(self.log), 1)
+		self.assertEqual(list(self.log.all_messages()), [('You hit.  It blocks.', RED)])
+
+	def test_visible_lines_are_wrapped(self):
+		self.fill(2)
+		self.log.add('a long message that takes two lines', RED)
+		lines = self.log.visible_lines()
+		self.assertEqual(texts(lines), ['message 0', 'message 1', 'a long message that', 'takes two lines'])
+		self.assertEqual(lines[-1][1], RED)
+
+		#the oldest message shown may only have its last lines on screen
+		for text in ('next', 'last', 'final'):
+			self.log.add(text, WHITE)
+		self.assertEqual(texts(self.log.visible_lines()), ['takes two lines', 'next', 'last', 'final'])
+
+	def test_history_lines(self):
+		self.log.add('a long message that takes two lines', RED)
+		self.fill(5)
+		lines = self.log.history_lines()
+		self.assertEqual(texts(lines), ['a long message that', 'takes two lines'] + ['message ' + str(i) for i in range(5)])
+		self.assertEqual(lines[1][1], RED)
+
+	def test_saved_state(self):
+		self.fill(HISTORY_CHUNK + 10)
+		copy = pickle.loads(pickle.dumps(self.log, 2))
+		self.assertEqual(list(copy.all_messages()), list(self.log.all_messages()))
+		self.assertEqual(copy.visible_lines(), self.log.visible_lines())
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+# Tests of the per-tile index of a level's objects.
+#
+#   python -m unittest test_object_index
+
+import pickle
+import unittest
+
+from object_index import ObjectIndex
+
+class Thing(object):
+	def __init__(self, name, x, y, blocks=False, fighter=None):
+		self.name = name
+		self.x = x
+		self.y = y
+		self.blocks = blocks
+		self.fighter = fighter
+
+	def __repr__(self):
+		return self.name
+
+class ObjectIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.stairs = Thing('stairs', 1, 1)
+		self.item = Thing('item', 1, 1)
+		self.monster = Thing('monster', 2, 1, blocks=True, fighter=True)
+		self.objects = ObjectIndex([self.stairs, self.item, self.monster])
+
+	def assertInStep(self):
+		#every object is indexed on its tile, in list order, and nothing else is
+		cells = {}
+		for obj in self.objects:
+			cells.setdefault((obj.x, obj.y), []).append(obj)
+		self.assertEqual(self.objects.groups, cells)
+
+	def test_list_interface(self):
+		self.assertEqual(list(self.objects), [self.stairs, self.item, self.monster])
+		self.assertEqual(len(self.objects), 3)
+		self.assertEqual(self.objects[2], self.monster)
+		self.assertEqual(self.objects.index(self.item), 1)
+		self.assertTrue(self.item in self.objects)
+		self.assertFalse(Thing('elsewhere', 1, 1) in self.objects)
+
+	def test_tile_queries(self):
+		self.assertEqual(list(self.objects.at(1, 1)), [self.stairs, self.item])
+		self.assertEqual(list(self.objects.at(5, 5)), [])
+		self.assertIs(self.objects.blocking_at(2, 1), self.monster)
+		self.assertIs(self.objects.blocking_at(1, 1), None)
+		self.assertIs(self.objects.fighter_at(2, 1), self.monster)
+
+	def test_move(self):
+		self.objects.move(self.monster, 1, 1)
+		self.assertEqual((self.monster.x, self.monster.y), (1, 1))
+		self.assertIs(self.objects.blocking_at(1, 1), self.monster)
+		self.assertIs(self.objects.blocking_at(2, 1), None)
+		self.assertInStep()
+
+		#objects of another level only get their position
+		other = Thing('other', 3, 3)
+		self.objects.move(other, 4, 4)
+		self.assertEqual((other.x, other.y), (4, 4))
+		self.assertFalse(other in self.objects)
+		self.assertInStep()
+
+	def test_remove(self):
+		self.objects.remove(self.item)
+		self.assertEqual(list(self.objects.at(1, 1)), [self.stairs])
+		self.objects.remove(self.monster)
+		self.assertEqual(list(self.objects), [self.stairs])
+		self.assertInStep()
+
+	def test_insert(self):
+		#insert(0, ...) is how things are sent to the back
+		self.objects.remove(self.item)
+		self.objects.insert(0, self.item)
+		self.assertEqual(list(self.objects.at(1, 1)), [self.item, self.stairs])
+		self.assertInStep()
+
+		#in the middle of the list, and of the tile
+		rubble = Thing('rubble', 1, 1)
+		self.objects.insert(1, rubble)
+		self.assertEqual(list(self.objects.at(1, 1)), [self.item, rubble, self.stairs])
+		self.objects.insert(-1, Thing('dust', 2, 1))
+		self.assertEqual([obj.name for obj in self.objects.at(2, 1)], ['dust', 'monster'])
+		self.assertInStep()
+
+	def test_pickle(self):
+		copy = pickle.loads(pickle.dumps(self.objects, pickle.HIGHEST_PROTOCOL))
+		self.assertEqual([obj.name for obj in copy], ['stairs', 'item', 'monster'])
+		self.assertEqual([obj.name for obj in copy.at(1, 1)], ['stairs', 'item'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+# Tests of the save file format, and of saving and loading a whole game.
+#
+#   python -m unittest test_savefile
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import main
+import savefile
+
+class Note(object):
+	def __init__(self, name):
+		self.name = name
+
+NAMESPACE = {'Note': Note}
+
+class SaveFileTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.filename = os.path.join(self.directory, 'test.sav')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_shared_objects_stay_shared(self):
+		note = Note('note')
+		savefile.write(self.filename, {'a': note, 'b': [note, (1, 'x')]}, NAMESPACE, savefile.ZLIB)
+		game = savefile.read(self.filename, NAMESPACE)
+		self.assertEqual(game['a'].name, 'note')
+		self.assertIs(game['b'][0], game['a'])
+		self.assertEqual(game['b'][1], (1, 'x'))
+
+	def test_older_versions_are_migrated(self):
+		#a version 0 save called the note's field 'text'
+		savefile.SAVE_VERSION = 0
+		try:
+			savefile.write(self.filename, {'note': Note('note')}, NAMESPACE, savefile.NONE)
+		finally:
+			savefile.SAVE_VERSION = 1
+		self.assertRaises(savefile.SaveError, savefile.read, self.filename, NAMESPACE)
+
+		def rename_field(body):
+			records = []
+			for (name, fields) in body['records']:
+				(tag, items) = fields
+				records.append((name, (tag, [('text' if k == 'name' else k, v) for (k, v) in items])))
+			body['records'] = records
+			return body
+		savefile.MIGRATIONS[0] = rename_field
+		try:
+			game = savefile.read(self.filename, NAMESPACE)
+		finally:
+			del savefile.MIGRATIONS[0]
+		self.assertEqual(game['note'].text, 'note')
+
+	def test_bad_files_are_refused(self):
+		savefile.write(self.filename, {'a': 1}, NAMESPACE, savefile.NONE)
+		with open(self.filename, 'r+b') as file:
+			file.seek(-1, os.SEEK_END)
+			file.write(b'!')
+		self.assertRaises(savefile.SaveError, savefile.read, self.filename, NAMESPACE)
+
+		with open(self.filename, 'wb') as file:
+			file.write(b'not a save game')
+		self.assertRaises(savefile.SaveError, savefile.read, self.filename, NAMESPACE)
+
+class GameSaveTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.globals = (main.SAVE_FILE, main.LEVELS_DIR)
+		main.SAVE_FILE = os.path.join(self.directory, 'savegame.sav')
+		main.LEVELS_DIR = main.SAVE_FILE + '.levels'
+		main.init(headless=True)
+		main.new_game(seed=5)
+
+	def tearDown(self):
+		(main.SAVE_FILE, main.LEVELS_DIR) = self.globals
+		shutil.rmtree(self.directory)
+
+	def test_save_and_load(self):
+		main.map.set('explored', main.player.x, main.player.y, True)
+		for turn in range(3):
+			main.take_monster_turns()
+		before = {
+			'map': main.map.__getstate__(),
+			'player': (main.player.x, main.player.y, main.player.fighter.hp),
+			'objects': [(obj.name, obj.x, obj.y) for obj in main.objects],
+			'time': main.scheduler.time,
+			'queued': len(main.scheduler),
+			'events': [event[2].__name__ for event in sorted(main.scheduler.events)],
+			'messages': [text for (text, color) in main.game_msgs.all_messages()],
+			'seed': main.streams.seed,
+		}
+		main.save_game()
+
+		main.new_game(seed=6)  #something else in memory
+		main.load_game()
+		self.assertEqual(main.map.__getstate__(), before['map'])
+		self.assertEqual((main.player.x, main.player.y, main.player.fighter.hp), before['player'])
+		self.assertEqual([(obj.name, obj.x, obj.y) for obj in main.objects], before['objects'])
+		self.assertIs(main.objects.fighter_at(main.player.x, main.player.y), main.player)
+		self.assertEqual(main.scheduler.time, before['time'])
+		self.assertEqual(len(main.scheduler), before['queued'])
+		self.assertEqual([event[2].__name__ for event in sorted(main.scheduler.events)], before['events'])
+		self.assertEqual([text for (text, color) in main.game_msgs.all_messages()][:-1], before['messages'])  #and 'Welcome back'
+		self.assertEqual(main.streams.seed, before['seed'])
+
+if __name__ == '__main__':
+	unittest.main()
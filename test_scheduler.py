@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+# Tests of the turn scheduler, and of saving it with the game.
+#
+#   python -m unittest test_scheduler
+
+import pickle
+import unittest
+
+import savefile
+from scheduler import TurnScheduler
+
+class Actor(object):
+	def __init__(self, name):
+		self.name = name
+
+def note(log, text):
+	log.append(text)
+
+NAMESPACE = {'Actor': Actor, 'TurnScheduler': TurnScheduler, 'note': note}
+
+def save_and_load(scheduler):
+	return savefile.restore(savefile.snapshot({'scheduler': scheduler}, NAMESPACE), NAMESPACE)['scheduler']
+
+class SchedulerTest(unittest.TestCase):
+	def setUp(self):
+		self.scheduler = TurnScheduler()
+		(self.a, self.b, self.c) = (Actor('a'), Actor('b'), Actor('c'))
+		self.scheduler.add(self.a, 10)
+		self.scheduler.add(self.b, 20)
+		self.scheduler.add(self.c, 30)
+		self.scheduler.remove(self.c)
+
+	def test_turns_in_time_order(self):
+		self.assertIs(self.scheduler.pop(), self.a)
+		self.assertIs(self.scheduler.pop(), self.b)
+		self.assertIs(self.scheduler.pop(), None)
+		self.assertEqual(self.scheduler.time, 20)
+
+	def test_remove_after_loading(self):
+		for load in (save_and_load, lambda scheduler: pickle.loads(pickle.dumps(scheduler, 2))):
+			scheduler = load(self.scheduler)
+			self.assertEqual(len(scheduler), 2)
+			(a, b) = sorted(scheduler.entries, key=lambda actor: actor.name)
+			self.assertIs(scheduler.entries[a], scheduler.queue[0])  #shared again
+			scheduler.remove(a)  #killed while queued
+			self.assertIs(scheduler.pop(), b)
+			self.assertIs(scheduler.pop(), None)
+
+	def test_events_are_saved(self):
+		log = []
+		self.scheduler.call_later(15, note, log, 'event')
+		scheduler = save_and_load(self.scheduler)
+		log = scheduler.events[0][3][0]
+		scheduler.pop()
+		scheduler.pop()
+		self.assertEqual(log, ['event'])
+
+if __name__ == '__main__':
+	unittest.main()
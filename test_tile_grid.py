@@ -0,0 +1,80 @@
+#!/usr/bin/python
+
+# Tests of the array-backed map.
+#
+#   python -m unittest test_tile_grid
+
+import pickle
+import unittest
+
+from tile_grid import TileGrid, LAYERS
+
+def layers(grid):
+	#the layers as plain lists of 0/1, whatever they are stored in
+	return dict((layer, [1 if v else 0 for v in getattr(grid, layer)]) for layer in LAYERS)
+
+class TileGridTest(unittest.TestCase):
+	def setUp(self):
+		#odd sizes, so the packed layers don't end on a byte boundary
+		self.grid = TileGrid(13, 7)
+		self.grid.carve(2, 1, 6, 4)
+		self.grid.set('explored', 3, 2, True)
+		self.grid.set('block_sight', 12, 6, False)
+
+	def test_new_grid_is_rock(self):
+		grid = TileGrid(4, 3)
+		self.assertTrue(grid.get('blocked', 0, 0))
+		self.assertTrue(grid.get('block_sight', 3, 2))
+		self.assertFalse(grid.get('explored', 3, 2))
+		self.assertFalse(TileGrid(4, 3, blocked=False).get('block_sight', 1, 1))
+
+	def test_get_and_set(self):
+		self.assertFalse(self.grid.get('blocked', 2, 1))
+		self.assertFalse(self.grid.get('blocked', 5, 3))
+		self.assertTrue(self.grid.get('blocked', 6, 3))  #carve() excludes x2
+		self.assertTrue(self.grid.get('blocked', 5, 4))  #and y2
+		self.assertTrue(self.grid.get('explored', 3, 2))
+		self.assertFalse(self.grid.get('explored', 2, 3))
+		self.grid.set('blocked', 3, 2, True)
+		self.assertTrue(self.grid.get('blocked', 3, 2))
+		self.assertEqual(self.grid.blocked[self.grid.index(3, 2)], 1)
+
+	def test_tile_views(self):
+		#the old map[x][y].property interface reads and writes the layers
+		self.assertEqual(len(self.grid), 13)
+		self.assertEqual(len(self.grid[0]), 7)
+		self.assertFalse(self.grid[3][2].blocked)
+		self.grid[3][2].blocked = True
+		self.assertTrue(self.grid.get('blocked', 3, 2))
+		self.assertTrue(self.grid[-1][-1].blocked)
+		self.assertRaises(IndexError, lambda: self.grid[13])
+
+	def test_open_cells(self):
+		cells = set((x, y) for (x, y, transparent, walkable) in self.grid.open_cells())
+		carved = set((x, y) for x in range(2, 6) for y in range(1, 4))
+		self.assertEqual(cells, carved | set([(12, 6)]))
+		self.assertIn((12, 6, True, False), list(self.grid.open_cells()))
+
+	def test_saved_state_is_packed(self):
+		state = self.grid.__getstate__()
+		for layer in LAYERS:
+			self.assertEqual(len(state['layers'][layer]), (13 * 7 + 7) // 8)
+		loaded = TileGrid.__new__(TileGrid)
+		loaded.__setstate__(state)
+		self.assertEqual((loaded.width, loaded.height), (13, 7))
+		self.assertEqual(layers(loaded), layers(self.grid))
+
+	def test_pickle_copies_the_layers(self):
+		copy = pickle.loads(pickle.dumps(self.grid, pickle.HIGHEST_PROTOCOL))
+		self.assertEqual(layers(copy), layers(self.grid))
+		copy.set('explored', 0, 0, True)
+		self.assertFalse(self.grid.get('explored', 0, 0))
+
+	def test_unpickle_unpacked_state(self):
+		#grids pickled before the layers were packed kept them in __dict__
+		old = TileGrid.__new__(TileGrid)
+		old.__setstate__(dict(self.grid.__dict__))
+		self.assertEqual(layers(old), layers(self.grid))
+
+if __name__ == '__main__':
+	unittest.main()
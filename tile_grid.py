@@ -0,0 +1,228 @@
+#!/usr/bin/python
+
+#Array-backed storage for the map tiles.
+#
+#Instead of one Tile object per cell, the map keeps one flat boolean array per
+#tile property. Cell (x, y) lives at index x * height + y in every layer.
+#NumPy arrays are used when NumPy is installed, plain bytearrays otherwise.
+#map[x][y].blocked and friends keep working through small view objects, so
+#older code does not need to know about the layout.
+#When saved, each layer is packed to one bit per tile. Pickle (which only
+#copies the game, see savefile.BackgroundWriter) takes the layers as they are.
+
+try:  #import NumPy if available
+	import numpy
+	numpy_available = True
+except ImportError:
+	numpy_available = False
+
+#the per-tile properties stored by the grid, in save order
+LAYERS = ('blocked', 'block_sight', 'explored')
+
+def unpickle_grid(width, height, layers):
+	#makes the grid pickled by TileGrid.__reduce__()
+	grid = TileGrid.__new__(TileGrid)
+	grid.width = width
+	grid.height = height
+	for (layer, data) in zip(LAYERS, layers):
+		setattr(grid, layer, data if numpy_available else bytearray(data))
+	return grid
+
+class TileGrid(object):
+	#the whole map: one contiguous array per tile property.
+	def __init__(self, width, height, blocked=True, block_sight=None):
+		self.width = width
+		self.height = height
+
+		#by default, if a tile is blocked, it also blocks sight
+		if block_sight is None: block_sight = blocked
+		self.blocked = self.new_layer(blocked)
+		self.block_sight = self.new_layer(block_sight)
+
+		#all tiles start unexplored
+		self.explored = self.new_layer(False)
+
+	@classmethod
+	def from_tiles(cls, tiles):
+		#build a grid from an old list-of-lists of Tile objects (old save games)
+		grid = cls(len(tiles), len(tiles[0]))
+		for x, column in enumerate(tiles):
+			for y, tile in enumerate(column):
+				i = grid.index(x, y)
+				grid.blocked[i] = tile.blocked
+				grid.block_sight[i] = tile.block_sight
+				grid.explored[i] = tile.explored
+		return grid
+
+	def new_layer(self, value=False):
+		#returns a new layer the size of the map, filled with value
+		n = self.width * self.height
+		if numpy_available:
+			layer = numpy.empty(n, dtype=numpy.bool_)
+			layer.fill(bool(value))
+			return layer
+		return bytearray([1 if value else 0]) * n
+
+	def index(self, x, y):
+		#position of cell (x, y) in every layer
+		return x * self.height + y
+
+	def get(self, layer, x, y):
+		return bool(getattr(self, layer)[x * self.height + y])
+
+	def set(self, layer, x, y, value):
+		getattr(self, layer)[x * self.height + y] = 1 if value else 0
+
+	def fill(self, layer, value):
+		#set one property on every tile of the map
+		data = getattr(self, layer)
+		if numpy_available:
+			data.fill(bool(value))
+		else:
+			data[:] = bytearray([1 if value else 0]) * len(data)
+
+	def fill_rect(self, layer, x1, y1, x2, y2, value):
+		#set one property on the tiles x1 <= x < x2, y1 <= y < y2
+		if x2 <= x1 or y2 <= y1:
+			return
+		if numpy_available:
+			self.view(layer)[x1:x2, y1:y2] = bool(value)
+			return
+
+		data = getattr(self, layer)
+		run = bytearray([1 if value else 0]) * (y2 - y1)
+		for x in range(x1, x2):
+			start = x * self.height
+			data[start + y1:start + y2] = run
+
+	def carve(self, x1, y1, x2, y2):
+		#make the tiles x1 <= x < x2, y1 <= y < y2 passable and see-through
+		self.fill_rect('blocked', x1, y1, x2, y2, False)
+		self.fill_rect('block_sight', x1, y1, x2, y2, False)
+
+	def open_cells(self):
+		#yields (x, y, transparent, walkable) for every tile that isn't solid
+		#rock, i.e. that doesn't both block movement and sight
+		if numpy_available:
+			cells = numpy.flatnonzero(~(self.blocked & self.block_sight))
+		else:
+			cells = [i for i in range(len(self.blocked)) if not (self.blocked[i] and self.block_sight[i])]
+		for i in cells:
+			i = int(i)
+			(x, y) = divmod(i, self.height)
+			yield (x, y, not self.block_sight[i], not self.blocked[i])
+
+	def pack_layer(self, layer):
+		#returns the layer as a string of bits, 8 tiles per byte, first tile
+		#in the highest bit
+		data = getattr(self, layer)
+		if numpy_available:
+			return numpy.packbits(numpy.asarray(data, dtype=numpy.bool_)).tobytes()
+		packed = bytearray((len(data) + 7) // 8)
+		for i in range(len(data)):
+			if data[i]:
+				packed[i >> 3] |= 128 >> (i & 7)
+		return bytes(packed)
+
+	def unpack_layer(self, layer, packed):
+		#fills the layer from a string made by pack_layer()
+		n = self.width * self.height
+		if numpy_available:
+			bits = numpy.unpackbits(numpy.frombuffer(packed, dtype=numpy.uint8))[:n]
+			setattr(self, layer, bits.astype(numpy.bool_))
+			return
+		packed = bytearray(packed)
+		setattr(self, layer, bytearray(1 if packed[i >> 3] & (128 >> (i & 7)) else 0 for i in range(n)))
+
+	def __getstate__(self):
+		return {'width': self.width, 'height': self.height,
+			'layers': dict((layer, self.pack_layer(layer)) for layer in LAYERS)}
+
+	def __reduce__(self):
+		#for pickle: copies of the layers, much faster than packing them
+		layers = [getattr(self, layer) for layer in LAYERS]
+		if not numpy_available:
+			layers = [bytes(data) for data in layers]
+		return (unpickle_grid, (self.width, self.height, layers))
+
+	def __setstate__(self, state):
+		if 'layers' not in state:  #pickled before layers were packed
+			self.__dict__.update(state)
+			return
+		self.width = state['width']
+		self.height = state['height']
+		for layer in LAYERS:
+			self.unpack_layer(layer, state['layers'][layer])
+
+	def view(self, layer):
+		#returns a (width, height) NumPy view of a layer, indexed [x, y].
+		#writes to the view go straight to the grid. needs NumPy.
+		if not numpy_available:
+			raise TypeError('TileGrid.view needs NumPy.')
+		return getattr(self, layer).reshape(self.width, self.height)
+
+	#compatibility with the old list of lists: map[x][y].blocked
+	def __len__(self):
+		return self.width
+
+	def __getitem__(self, x):
+		if x < 0:
+			x += self.width
+		if x < 0 or x >= self.width:
+			raise IndexError('TileGrid column out of range')
+		return TileColumn(self, x)
+
+	def __iter__(self):
+		for x in range(self.width):
+			yield TileColumn(self, x)
+
+class TileColumn(object):
+	#one column of the grid, so that map[x][y] works
+	__slots__ = ('grid', 'x')
+
+	def __init__(self, grid, x):
+		self.grid = grid
+		self.x = x
+
+	def __len__(self):
+		return self.grid.height
+
+	def __getitem__(self, y):
+		height = self.grid.height
+		if y < 0:
+			y += height
+		if y < 0 or y >= height:
+			raise IndexError('TileGrid row out of range')
+		return TileView(self.grid, self.x * height + y)
+
+class TileView(object):
+	#stands in for a Tile: reads and writes go to the grid's arrays
+	__slots__ = ('grid', 'i')
+
+	def __init__(self, grid, i):
+		self.grid = grid
+		self.i = i
+
+	@property
+	def blocked(self):
+		return bool(self.grid.blocked[self.i])
+
+	@blocked.setter
+	def blocked(self, value):
+		self.grid.blocked[self.i] = 1 if value else 0
+
+	@property
+	def block_sight(self):
+		return bool(self.grid.block_sight[self.i])
+
+	@block_sight.setter
+	def block_sight(self, value):
+		self.grid.block_sight[self.i] = 1 if value else 0
+
+	@property
+	def explored(self):
+		return bool(self.grid.explored[self.i])
+
+	@explored.setter
+	def explored(self, value):
+		self.grid.explored[self.i] = 1 if value else 0